@@ -1,4 +1,4 @@
-import math
+import array, heapq, json, math, multiprocessing, os, pickle, time
 
 class Point2D:
     def __init__(self, x:float, y:float):
@@ -169,56 +169,295 @@ class CubeOutline(Cube):
         lb = Line3D(p7.copy(),p8.copy(),color=edgecolor); lc = Line3D(p8.copy(),p5.copy(),color=edgecolor)
         elements = [l1,l2,l3,l4,l5,l6,l7,l8,l9,la,lb,lc]
         del p1, p2, p3, p4, p5, p6, p7, p8
-        super().__init__(elements,center)
+        Object.__init__(self,elements,center) # Cube.__init__ would rebuild the faces
+
+def _plane_quadric(p0, p1, p2): # fundamental error quadric of a triangle's plane, upper triangle of the 4x4 matrix
+    ux,uy,uz = p1[0]-p0[0],p1[1]-p0[1],p1[2]-p0[2]
+    vx,vy,vz = p2[0]-p0[0],p2[1]-p0[1],p2[2]-p0[2]
+    a,b,c = uy*vz-uz*vy,uz*vx-ux*vz,ux*vy-uy*vx
+    n = math.sqrt(a*a+b*b+c*c)
+    if n==0: return [0.0]*10
+    area = n/2 # area weighted
+    a,b,c = a/n,b/n,c/n
+    d = -(a*p0[0]+b*p0[1]+c*p0[2])
+    return [area*q for q in (a*a,a*b,a*c,a*d,b*b,b*c,b*d,c*c,c*d,d*d)]
+
+def _quadric_error(q, p) -> float:
+    x,y,z = p
+    return (q[0]*x*x+2*q[1]*x*y+2*q[2]*x*z+2*q[3]*x+q[4]*y*y+2*q[5]*y*z+2*q[6]*y
+        +q[7]*z*z+2*q[8]*z+q[9])
+
+def _triangle_normal(p0, p1, p2):
+    ux,uy,uz = p1[0]-p0[0],p1[1]-p0[1],p1[2]-p0[2]
+    vx,vy,vz = p2[0]-p0[0],p2[1]-p0[1],p2[2]-p0[2]
+    return (uy*vz-uz*vy,uz*vx-ux*vz,ux*vy-uy*vx)
+
+def simplify_mesh(vertices, faces, target_faces:int):
+    # quadric error edge collapse, vertices are (x,y,z) tuples and faces index lists; returns a triangle mesh
+    weld = {} # merge duplicated positions so seams do not open up as holes
+    vertex_index = []
+    for v in vertices: vertex_index.append(weld.setdefault(tuple(v),len(weld)))
+    vertices = list(weld)
+    triangles = [[vertex_index[f[0]],vertex_index[f[i]],vertex_index[f[i+1]]] for f in faces for i in range(1,len(f)-1)] # fan triangulation
+    triangles = [t for t in triangles if len(set(t))==3]
+    alive = [True]*len(triangles)
+    vertex_faces = [set() for _ in vertices]
+    quadrics = [[0.0]*10 for _ in vertices]
+    for t,(i,j,k) in enumerate(triangles):
+        q = _plane_quadric(vertices[i],vertices[j],vertices[k])
+        for v in (i,j,k):
+            vertex_faces[v].add(t)
+            quadrics[v] = [a+b for a,b in zip(quadrics[v],q)]
+    edge_faces = {}
+    for t,tri in enumerate(triangles):
+        for e in range(3): edge_faces.setdefault(frozenset((tri[e],tri[e-1])),[]).append(t)
+    for edge,edge_triangles in edge_faces.items(): # open boundaries get a heavy plane perpendicular to their face
+        if len(edge_triangles)!=1 or len(edge)!=2: continue
+        i,j = edge
+        k = next(u for u in triangles[edge_triangles[0]] if u not in edge)
+        pi,pj,pk = vertices[i],vertices[j],vertices[k]
+        n = _triangle_normal(pi,pj,pk)
+        q = _plane_quadric(pi,pj,(pi[0]+n[0],pi[1]+n[1],pi[2]+n[2]))
+        for v in (i,j): quadrics[v] = [a+1000*b for a,b in zip(quadrics[v],q)]
+    version = [0]*len(vertices) # bumped on every change, stale heap entries are skipped
+
+    def collapse_candidate(v1, v2):
+        q = [a+b for a,b in zip(quadrics[v1],quadrics[v2])]
+        p1,p2 = vertices[v1],vertices[v2]
+        mid = ((p1[0]+p2[0])/2,(p1[1]+p2[1])/2,(p1[2]+p2[2])/2)
+        return min((_quadric_error(q,p),p) for p in (p1,p2,mid))
+
+    heap = []
+    def push_edges(v):
+        for t in vertex_faces[v]:
+            for u in triangles[t]:
+                if u!=v:
+                    cost,_ = collapse_candidate(v,u)
+                    heapq.heappush(heap,(cost,v,u,version[v],version[u]))
+    for v in range(len(vertices)):
+        for t in vertex_faces[v]:
+            for u in triangles[t]:
+                if u>v:
+                    cost,_ = collapse_candidate(v,u)
+                    heap.append((cost,v,u,0,0))
+    heapq.heapify(heap)
+
+    face_count = len(triangles)
+    while face_count>target_faces and heap:
+        _,v1,v2,s1,s2 = heapq.heappop(heap)
+        if s1!=version[v1] or s2!=version[v2]: continue
+        _,p = collapse_candidate(v1,v2)
+        shared = vertex_faces[v1]&vertex_faces[v2]
+        flipped = False # reject collapses that fold a surviving triangle over
+        for t in (vertex_faces[v1]|vertex_faces[v2])-shared:
+            old = [vertices[u] for u in triangles[t]]
+            new = [p if u in (v1,v2) else vertices[u] for u in triangles[t]]
+            n0,n1 = _triangle_normal(*old),_triangle_normal(*new)
+            if n0[0]*n1[0]+n0[1]*n1[1]+n0[2]*n1[2]<=0: flipped = True; break
+        if flipped: continue
+        for t in shared:
+            alive[t] = False
+            face_count -= 1
+            for u in triangles[t]: vertex_faces[u].discard(t)
+        for t in vertex_faces[v2]:
+            triangles[t] = [v1 if u==v2 else u for u in triangles[t]]
+            vertex_faces[v1].add(t)
+        vertex_faces[v2] = set()
+        vertices[v1] = p
+        quadrics[v1] = [a+b for a,b in zip(quadrics[v1],quadrics[v2])]
+        version[v1] += 1; version[v2] += 1
+        push_edges(v1)
+
+    remap,out_vertices,out_faces = {},[],[]
+    for t,tri in enumerate(triangles):
+        if not alive[t]: continue
+        if _triangle_normal(*[vertices[u] for u in tri])==(0,0,0): continue # degenerate
+        for u in tri:
+            if u not in remap:
+                remap[u] = len(out_vertices)
+                out_vertices.append(vertices[u])
+        out_faces.append([remap[u] for u in tri])
+    return out_vertices,out_faces
+
+def read_obj(filename:str): # (vertices as (x,y,z) tuples, faces as lists of vertex indices)
+    f = open(filename,"r"); lines = f.read().split("\n"); f.close()
+    vertices,faces = [],[]
+    for line in lines:
+        l = list(filter(lambda x:x!="",line.split(" ")))
+        if len(l)==0: continue
+        if l[0]=="v": vertices.append((float(l[1]),float(l[2]),float(l[3])))
+        elif l[0]=="f": faces.append([int(l[i].split("/")[0])-1 for i in range(1,len(l))])
+    return vertices,faces
+
+def load_lods(filename:str, vertices, faces, lod_levels:int): # [(vertices,faces)] of every level below the full mesh
+    # each level has half the faces of the previous one, starting from the polygon count of level 0 so that
+    # quad meshes shrink too; cached as plain json next to the obj file
+    cache_filename = filename+".lod.json"
+    st = os.stat(filename)
+    key = [2,st.st_mtime_ns,st.st_size,lod_levels] # leading format version, bumped when the levels built change
+    try:
+        with open(cache_filename,"r") as f: cached = json.load(f)
+        if cached["key"]==key:
+            return [([tuple(float(c) for c in v) for v in level_vertices],[[int(i) for i in face] for face in level_faces])
+                for level_vertices,level_faces in cached["levels"]]
+    except (OSError,ValueError,KeyError,TypeError):
+        pass # missing, stale or malformed, rebuilt below
+    levels = []
+    target = len(faces)
+    for _ in range(lod_levels):
+        target //= 2
+        vertices,faces = simplify_mesh(vertices,faces,max(target,4))
+        levels.append((vertices,faces))
+    try:
+        with open(cache_filename,"w") as f: json.dump({"key":key,"levels":levels},f)
+    except OSError:
+        pass # read-only checkout, levels are simply rebuilt next time
+    return levels
 
 class WavefrontObj(Object):
-    def __init__(self, filename:str, facecolor="white"):
-        f = open(filename,"r"); lines = f.read().split("\n"); f.close()
-        points = []
-        elements = []
-        for line in lines:
-            l = list(filter(lambda x:x!="",line.split(" ")))
-            if len(l)==0: continue
-            if l[0]=="v": points.append(Point3D(float(l[1]),float(l[2]),float(l[3])))
-            elif l[0]=="f":
-                face_vertices = []
-                for i in range(1,len(l)):
-                    if l[i]=="": continue
-                    index = int(l[i].split("/")[0])-1
-                    face_vertices.append(points[index].copy())
-                elements.append(Polygon3D(face_vertices,color=facecolor))
-        print("loaded",len(elements),"polygon faces")
+    def __init__(self, filename:str, facecolor="white", lod_levels:int=0):
+        vertices,faces = read_obj(filename)
+        levels = load_lods(filename,vertices,faces,lod_levels) if lod_levels>0 else []
+        self._build(vertices,faces,levels,facecolor)
+        print("loaded",len(self.elements),"polygon faces")
+        if levels: print("lod faces",[len(level) for level in self.lods])
+
+    @classmethod
+    def from_mesh(cls, vertices, faces, levels=(), facecolor="white"): # fresh polygons from lists a caller keeps, e.g. across jobs
+        obj = cls.__new__(cls)
+        obj._build(vertices,faces,levels,facecolor)
+        return obj
+
+    def _build(self, vertices, faces, levels, facecolor):
+        points = [Point3D(*v) for v in vertices]
+        elements = [Polygon3D([points[i].copy() for i in face],color=facecolor) for face in faces]
         sx,sy,sz = 0,0,0
         for point in points:
             sx += point.x; sy += point.y; sz += point.z
-        super().__init__(elements,Point3D(sx/len(points),sy/len(points),sz/len(points)))
-
-class WavefrontObjOutline(Object):
-    def __init__(self, filename:str):
-        f = open(filename,"r"); lines = f.read().split("\n"); f.close()
-        points = []
-        elements = []
-        lines_index_set = set()
-        for line in lines:
-            l = list(filter(lambda x:x!="",line.split(" ",)))
-            if len(l)==0: continue
-            if l[0]=="v": points.append(Point3D(float(l[1]),float(l[2]),float(l[3])))
-            elif l[0]=="f":
-                face_vertices_index = []
-                for i in range(1,len(l)):
-                    if l[i]=="": continue
-                    index = int(l[i].split("/")[0])-1
-                    face_vertices_index.append(index)
-                for i in range(len(face_vertices_index)):
-                    if (i,i-1) not in lines_index_set:
-                        index1,index2 = face_vertices_index[i],face_vertices_index[i-1]
-                        lines_index_set.add((index1,index2))
-                        lines_index_set.add((index2,index1))
-                        elements.append(Line3D(points[index1].copy(),points[index2].copy()))
+        center = Point3D(sx/len(points),sy/len(points),sz/len(points))
+        self.radius = max(LinAlg.sub(p,center).norm() for p in points) # bounding sphere, for lod selection
+        self.lods = [elements] # element lists, finest first
+        for level_vertices,level_faces in levels:
+            level_points = [Point3D(*v) for v in level_vertices]
+            self.lods.append([Polygon3D([level_points[i].copy() for i in face],color=facecolor) for face in level_faces])
+        super().__init__(elements,center)
+
+    def translate(self, x:float, y:float, z:float):
+        for level in self.lods[1:]:
+            for element in level: element.translate(x,y,z)
+        super().translate(x,y,z)
+
+    def rotate(self, center:Point3D, direction:Point3D, angle:float):
+        for level in self.lods[1:]:
+            for element in level: element.rotate(center,direction,angle)
+        super().rotate(center,direction,angle)
+
+class WavefrontObjOutline(Object): # shared vertices with deduplicated edges as index pairs
+    def __init__(self, filename:str, edgecolor="white"):
+        self._build(*read_obj(filename),edgecolor)
+        print("loaded",len(self.edges),"edges")
+
+    @classmethod
+    def from_mesh(cls, vertices, faces, edgecolor="white"):
+        obj = cls.__new__(cls)
+        obj._build(vertices,faces,edgecolor)
+        return obj
+
+    def _build(self, vertices, faces, edgecolor):
+        points = [Point3D(*v) for v in vertices]
+        edges = []
+        edge_set = set()
+        for face_vertices_index in faces:
+            for i in range(len(face_vertices_index)):
+                index1,index2 = face_vertices_index[i],face_vertices_index[i-1]
+                key = (index1,index2) if index1<index2 else (index2,index1)
+                if index1!=index2 and key not in edge_set:
+                    edge_set.add(key)
+                    edges.append(key)
+        self.points = points
+        self.edges = edges
+        self.color = edgecolor
         sx,sy,sz = 0,0,0
         for point in points:
             sx += point.x; sy += point.y; sz += point.z
-        super().__init__(elements,Point3D(sx/len(points),sy/len(points),sz/len(points)))
+        super().__init__([],Point3D(sx/len(points),sy/len(points),sz/len(points)))
+
+    def translate(self, x:float, y:float, z:float):
+        for point in self.points: point.translate(x,y,z)
+        self.center.translate(x,y,z)
+
+    def rotate(self, center:Point3D, direction:Point3D, angle:float):
+        for point in self.points: point.rotate(center,direction,angle)
+
+class HiZBuffer: # max-depth pyramid over a depth map, coarse cells reject hidden polygons before scanline work
+    def __init__(self, depth_map, block:int=8, origin=(0,0)):
+        self.depth_map = depth_map
+        self.h,self.w = len(depth_map),len(depth_map[0])
+        self.block = block
+        self.origin = origin # image position of depth_map[0][0], for tile-local buffers
+        self.levels = []
+        cw,ch = (self.w+block-1)//block,(self.h+block-1)//block
+        self.written = [bytearray(self.w) for _ in range(self.h)]
+        self.unwritten = [[min(block,self.w-cx*block)*min(block,self.h-cy*block) for cx in range(cw)] for cy in range(ch)] # inf pixels per cell
+        while True:
+            self.levels.append([[float("inf")]*cw for _ in range(ch)])
+            if cw==1 and ch==1: break
+            cw,ch = (cw+1)//2,(ch+1)//2
+
+    def update(self, pixels): # pixels (x,y) in image coordinates whose depth may have changed
+        ox,oy,b = self.origin[0],self.origin[1],self.block
+        written,unwritten = self.written,self.unwritten
+        cells = set()
+        for x,y in pixels:
+            x,y = x-ox,y-oy
+            cell = (x//b,y//b)
+            if not written[y][x]:
+                written[y][x] = 1
+                unwritten[cell[1]][cell[0]] -= 1
+            cells.add(cell)
+        cells = {(cx,cy) for cx,cy in cells if unwritten[cy][cx]==0} # a cell with an inf pixel keeps its inf max, no rescan
+        if not cells: return
+        level = self.levels[0]
+        for cx,cy in cells:
+            m = 0
+            for row in self.depth_map[cy*b:(cy+1)*b]:
+                v = max(row[cx*b:(cx+1)*b])
+                if v>m: m = v
+            level[cy][cx] = m
+        for k in range(1,len(self.levels)):
+            below,level = level,self.levels[k]
+            cells = {(cx//2,cy//2) for cx,cy in cells}
+            for cx,cy in cells:
+                m = 0
+                for row in below[2*cy:2*cy+2]:
+                    v = max(row[2*cx:2*cx+2])
+                    if v>m: m = v
+                level[cy][cx] = m
+
+    def occluded(self, x0:int, y0:int, x1:int, y1:int, zmin:float, max_cells:int=16) -> bool:
+        # inclusive pixel box in image coordinates, zmin the nearest depth of the polygon
+        ox,oy = self.origin
+        x0,y0,x1,y1 = max(x0-ox,0),max(y0-oy,0),min(x1-ox,self.w-1),min(y1-oy,self.h-1)
+        if x0>x1 or y0>y1: return True # entirely off screen
+        k = 0
+        while k<len(self.levels)-1 and ((x1//(self.block<<k))-(x0//(self.block<<k))>1 or (y1//(self.block<<k))-(y0//(self.block<<k))>1): k += 1
+        for k in range(k,-1,-1): # coarsest level covering the box with at most 2x2 cells first
+            s = self.block<<k
+            cx0,cx1,cy0,cy1 = x0//s,x1//s,y0//s,y1//s
+            if (cx1-cx0+1)*(cy1-cy0+1)>max_cells: break
+            level = self.levels[k]
+            if zmin>max(max(row[cx0:cx1+1]) for row in level[cy0:cy1+1]): return True
+        return False
+
+class RenderStats:
+    def __init__(self):
+        self.polygons = 0
+        self.culled = 0 # rejected by the hi-z test
+        self.lod = 0 # level of detail drawn
+        self.time = 0
+
+    def __str__(self) -> str:
+        return f"lod {self.lod}, {self.polygons} polygons, {self.culled} culled, {'%.3f'%self.time}s"
 
 class Renderer:
     def __init__(self, screenx:float, screeny:float, nearz:float):
@@ -228,6 +467,12 @@ class Renderer:
         self.scale = 80
         self.culling_threshold = 0
         self.img_size = (screenx*self.scale,screeny*self.scale)
+        self.antialias = True # wu lines for wireframes
+        self.line_depth_bias = 0.01 # relative, keeps edges on top of the faces they bound
+        self.occlusion_culling = False # hi-z test, polygons are then drawn front to back; pays off on deep meshes like tank
+        self.stats = RenderStats() # of the last frame
+        self.lod_pixels_per_face = 8 # finest level whose faces each still cover at least this many pixels is drawn
+        self.force_lod = None # level to draw regardless of screen size
 
     def project_point3d(self, point3d:Point3D) -> Point2D:
         x = point3d.x/point3d.z*self.nearz
@@ -245,14 +490,24 @@ class Renderer:
         return x1+(y-y1)*(x2-x1)/(y2-y1)
 
     def _calc_depth(self, polygon3d, i, j) -> float: # (i,j) on image pixel
+        return self._plane_depth(self._polygon_plane(polygon3d),i,j)
+
+    def _polygon_plane(self, polygon3d): # (normal x,y,z, normal.point) describing the polygon's plane
+        n,p = polygon3d.normal,polygon3d.points[0]
+        return (n.x,n.y,n.z,n.x*p.x+n.y*p.y+n.z*p.z)
+
+    def _plane_depth(self, plane, i, j) -> float:
         ray = ((i-self.screenx*self.scale/2)/self.scale,(j-self.screeny*self.scale/2)/self.scale,self.nearz)
-        num = polygon3d.normal.x*polygon3d.points[0].x+polygon3d.normal.y*polygon3d.points[0].y+polygon3d.normal.z*polygon3d.points[0].z
-        den = polygon3d.normal.x*ray[0]+polygon3d.normal.y*ray[1]+polygon3d.normal.z*ray[2]
-        t = num/den
+        den = plane[0]*ray[0]+plane[1]*ray[1]+plane[2]*ray[2]
+        if den==0: return float("inf") # polygon seen edge-on
+        t = plane[3]/den
         return ray[2]*t
 
-    def _fill_polygon(self, polygon3d, img_vertices, img, fill, depth_map):
-        ymin, ymax = max(min(img_vertices,key=lambda x:x[1])[1],0), min(max(img_vertices,key=lambda x:x[1])[1],self.img_size[1])
+    def _fill_polygon(self, plane, img_vertices, img, fill, depth_map, bounds=None, replace_ties=False):
+        # bounds (x0,y0,x1,y1) clips to a tile, img and depth_map are then local to that tile
+        # replace_ties lets equal depths overwrite, so front-to-back order resolves ties like back-to-front does
+        bx0,by0,bx1,by1 = bounds if bounds is not None else (0,0,self.img_size[0],self.img_size[1])
+        ymin, ymax = max(min(img_vertices,key=lambda x:x[1])[1],by0), min(max(img_vertices,key=lambda x:x[1])[1],by1)
         sides = [sorted([img_vertices[i],img_vertices[i-1]],key=lambda x:x[1]) for i in range(len(img_vertices))]
         pixels = []
         for y in range(ymin,ymax):
@@ -263,37 +518,407 @@ class Renderer:
                     if p_low[1]!=p_high[1]: x_intersects.add(self._interpolate_x(p_low,p_high,y))
                     else: x_intersects.update({side[0][0],side[1][0]})
             x_intersects = sorted(list(x_intersects))
-            if len(x_intersects)%2==1: pixels.append((int(x_intersects.pop(-1)),y))
+            depth_row = depth_map[y-by0]
+            if len(x_intersects)%2==1:
+                x = int(x_intersects.pop(-1))
+                if bx0<=x<bx1:
+                    depth = self._plane_depth(plane,x,y)
+                    if depth<depth_row[x-bx0] or (replace_ties and depth==depth_row[x-bx0]):
+                        pixels.append((x,y))
+                        depth_row[x-bx0] = depth
             for i in range(0,len(x_intersects),2):
-                x1, x2 = max(int(x_intersects[i]),0), min(int(x_intersects[i+1]),self.img_size[0])
+                x1, x2 = max(int(x_intersects[i]),bx0), min(int(x_intersects[i+1]),bx1)
                 for x in range(x1,x2):
-                    if (depth:=self._calc_depth(polygon3d,x,y))<depth_map[y][x]:
+                    depth = self._plane_depth(plane,x,y)
+                    if depth<depth_row[x-bx0] or (replace_ties and depth==depth_row[x-bx0]):
                         pixels.append((x,y))
-                        depth_map[y][x] = depth
+                        depth_row[x-bx0] = depth
         for pixel in pixels:
-            img[pixel[1]][pixel[0]] = fill
-    
+            img[pixel[1]-by0][pixel[0]-bx0] = fill
+        return pixels
+
+    def _prepare_polygon(self, polygon3d:Polygon3D, lighting:Point3D): # (image vertices, fill, plane)
+        n = polygon3d.normal
+        return self._prepare_points([(p.x,p.y,p.z) for p in polygon3d.points],(n.x,n.y,n.z),(lighting.x,lighting.y,lighting.z))
+
+    def _prepare_points(self, points, normal, lighting): # same as _prepare_polygon on plain (x,y,z) tuples
+        nearz,scale = self.nearz,self.scale
+        cx,cy = self.screenx*scale/2,self.screeny*scale/2
+        polygon_vertices = [(int(x/z*nearz*scale+cx),int(y/z*nearz*scale+cy)) for x,y,z in points]
+        nx,ny,nz = normal
+        n = -(nx*lighting[0]+ny*lighting[1]+nz*lighting[2])
+        d = int(255*(n*0.4+0.6))
+        x,y,z = points[0]
+        return (polygon_vertices,d,(nx,ny,nz,nx*x+ny*y+nz*z))
+
     def render_object_rasterize(self, obj:Object, lighting:Point3D=None):
         img = [[0]*self.img_size[0] for _ in range(self.img_size[1])]
         depth_map = [[float("inf")]*self.img_size[0] for _ in range(self.img_size[1])]
-        obj.elements.sort(key=lambda x:x.center().norm(),reverse=True) # sort polygons
-        for element3d in obj.elements:
+        stats,start = RenderStats(),time.time()
+        hiz = HiZBuffer(depth_map) if self.occlusion_culling else None
+        stats.lod,elements = self._lod_elements(obj)
+        elements.sort(key=lambda x:x.center().norm(),reverse=True) # sort polygons
+        if hiz is not None: elements.reverse() # front to back, so the hi-z buffer fills with near depths first
+        for element3d in elements:
             if isinstance(element3d,Polygon3D):
-                polygon2d = self.project_polygon3d(element3d)
-                polygon_vertices = []
-                for point in polygon2d.points:
-                    x,y = int(point.x*self.scale+self.screenx*self.scale/2),int(point.y*self.scale+self.screeny*self.scale/2)
-                    polygon_vertices.append((x,y))
-                n = -LinAlg.dot(element3d.normal,lighting)
-                d = int(255*(n*0.4+0.6))
-                self._fill_polygon(element3d,polygon_vertices,img,d,depth_map) # painter's algorithm with depth buffer
-            elif isinstance(element3d,Line3D):
-                line2d = self.project_line3d(element3d)
-                p1 = (line2d.point1.x*self.scale+self.screenx*self.scale/2,line2d.point1.y*self.scale+self.screeny*self.scale/2)
-                p2 = (line2d.point2.x*self.scale+self.screenx*self.scale/2,line2d.point2.y*self.scale+self.screeny*self.scale/2)
-                # draw.line([p1,p2],fill=element3d.color,width=2)
+                stats.polygons += 1
+                polygon_vertices,d,plane = self._prepare_polygon(element3d,lighting)
+                if hiz is not None and self._polygon_occluded(hiz,polygon_vertices,element3d,plane):
+                    stats.culled += 1
+                    continue
+                pixels = self._fill_polygon(plane,polygon_vertices,img,d,depth_map,replace_ties=hiz is not None) # painter's algorithm with depth buffer
+                if hiz is not None and pixels: hiz.update(pixels)
+        self._draw_lines(self._line_segments(elements),img,depth_map) # after the faces, tested against all of them
+        if isinstance(obj,WavefrontObjOutline): self.render_edges(obj,img,depth_map)
+        stats.time = time.time()-start
+        self.stats = stats
+        return img
+
+    def select_lod(self, obj:Object) -> int: # from the projected size of the object's bounding sphere
+        lods = getattr(obj,"lods",None)
+        if not lods or len(lods)==1: return 0
+        if self.force_lod is not None: return min(self.force_lod,len(lods)-1)
+        if obj.center.z<=obj.radius: return 0 # camera inside the bounding sphere
+        r = obj.radius/obj.center.z*self.nearz*self.scale
+        budget = math.pi*r*r/self.lod_pixels_per_face
+        for level,elements in enumerate(lods):
+            if len(elements)<=budget: return level
+        return len(lods)-1
+
+    def _lod_elements(self, obj:Object):
+        level = self.select_lod(obj)
+        return level,(obj.lods[level] if level>0 else obj.elements)
+
+    def lod_metrics(self, obj:Object, lighting:Point3D=None): # image difference of every level against the full mesh
+        force_lod,metrics = self.force_lod,[]
+        try:
+            reference = None
+            for level in range(len(getattr(obj,"lods",[None]))):
+                self.force_lod = level
+                img = self.render_object_rasterize(obj,lighting)
+                if reference is None: reference = img
+                n = self.img_size[0]*self.img_size[1]
+                diffs = [abs(a-b) for row_a,row_b in zip(img,reference) for a,b in zip(row_a,row_b)]
+                metrics.append({
+                    "level":level,
+                    "faces":self.stats.polygons,
+                    "time":self.stats.time,
+                    "mean_abs_diff":sum(diffs)/n,
+                    "changed_pixels":sum(1 for d in diffs if d>0)/n
+                })
+        finally:
+            self.force_lod = force_lod
+        return metrics
+
+    def _polygon_occluded(self, hiz:HiZBuffer, polygon_vertices, polygon3d:Polygon3D, plane=None) -> bool:
+        xs,ys = [v[0] for v in polygon_vertices],[v[1] for v in polygon_vertices]
+        zmin = self._polygon_zmin(polygon_vertices,min(p.z for p in polygon3d.points),plane)
+        return zmin is not None and hiz.occluded(min(xs),min(ys),max(xs),max(ys),zmin)
+
+    def _polygon_zmin(self, polygon_vertices, zmin:float, plane=None): # nearest depth it can write, None if unbounded
+        if plane is None: return zmin
+        xs,ys = [v[0] for v in polygon_vertices],[v[1] for v in polygon_vertices]
+        # edge pixels extend past the polygon, where its plane can be nearer than any vertex
+        corners = [self._plane_depth(plane,x,y) for x in (min(xs),max(xs)+1) for y in (min(ys),max(ys)+1)]
+        if min(corners)<=0 or max(corners)==float("inf"): return None # plane turns away inside the box
+        return min(zmin,min(corners))
+
+    def render_object_rasterize_tiled(self, obj:Object, lighting:Point3D=None, tile_size:int=64, processes:int=None):
+        # two parallel phases: workers project and bin chunks of polygons, then rasterize bands of tiles
+        # with local z-buffers; the parent only packs coordinates, merges bins and composites rows
+        w,h = self.img_size
+        stats,start = RenderStats(),time.time()
+        stats.lod,elements = self._lod_elements(obj)
+        coords,counts,normals = [],[],[] # flat per polygon, in element order
+        for e in elements:
+            if isinstance(e,Polygon3D):
+                for p in e.points: coords += (p.x,p.y,p.z)
+                counts.append(len(e.points))
+                n = e.normal; normals += (n.x,n.y,n.z)
+        workers = processes or multiprocessing.cpu_count()
+        if workers<=1: run = lambda f,tasks: [f(self,*task) for task in tasks] # nothing to gain from workers
+        else:
+            pool = self._get_pool(processes)
+            run = lambda f,tasks: pool.starmap(_run_in_tile_worker,[(f,task) for task in tasks])
+        chunk = max(256,-(-len(counts)//(workers*4)))
+        tiles_x,tiles_y = (w+tile_size-1)//tile_size,(h+tile_size-1)//tile_size
+        light = (lighting.x,lighting.y,lighting.z)
+        tasks,offset,first = [],0,0
+        for i in range(0,len(counts),chunk):
+            n = sum(counts[i:i+chunk])
+            tasks.append((i,array.array("d",coords[offset*3:(offset+n)*3]),array.array("i",counts[i:i+chunk]),
+                array.array("d",normals[i*3:(i+chunk)*3]),light,tile_size,tiles_x))
+            offset += n
+        chunks = run(Renderer._project_chunk,tasks)
+        bins = [[] for _ in range(tiles_x*tiles_y)] # (chunk, local ids) per tile
+        binned = {} # polygon id -> number of tiles it was binned into
+        for c,(first,_,_,chunk_bins) in enumerate(chunks):
+            for tile,ids in chunk_bins.items():
+                bins[tile].append((c,ids))
+                for i in ids: binned[first+i] = binned.get(first+i,0)+1
+        stats.polygons = len(counts) # every polygon once, as in the serial path
+        tiles = []
+        for i,tile_bins in enumerate(bins):
+            if not tile_bins: continue
+            tx,ty = i%tiles_x,i//tiles_x
+            tiles.append(((tx*tile_size,ty*tile_size,min((tx+1)*tile_size,w),min((ty+1)*tile_size,h)),tile_bins))
+        records = [c[:3] for c in chunks]
+        groups = min(len(tiles),workers*2) or 1 # contiguous runs of tiles, each task ships the records once
+        tasks = [(records,tiles[g*len(tiles)//groups:(g+1)*len(tiles)//groups]) for g in range(groups)]
+        img = [[0]*w for _ in range(h)]
+        depth_map = [[float("inf")]*w for _ in range(h)]
+        culled = {} # polygon id -> number of tiles it was culled in
+        for results in run(Renderer._rasterize_tiles,tasks):
+            for (x0,y0,x1,y1),tile_img,tile_depth,culled_ids in results:
+                for i in culled_ids: culled[i] = culled.get(i,0)+1
+                for j in range(y1-y0): # composite into the shared framebuffer
+                    img[y0+j][x0:x1] = tile_img[j]
+                    depth_map[y0+j][x0:x1] = tile_depth[j]
+        if self.occlusion_culling: # culled polygons are the ones no tile drew, off screen ones included like the serial hi-z test
+            stats.culled = len(counts)-len(binned)+sum(1 for i,n in culled.items() if n==binned[i])
+        self._draw_lines(self._line_segments(elements),img,depth_map)
+        if isinstance(obj,WavefrontObjOutline): self.render_edges(obj,img,depth_map)
+        stats.time = time.time()-start
+        self.stats = stats
         return img
 
+    def _project_chunk(self, first:int, coords, counts, normals, lighting, tile_size:int, tiles_x:int):
+        # phase one, in a worker: prepares the polygons numbered from first and bins them by screen bounding box
+        # returns (first, packed records, record offsets, {tile: local ids})
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None: return self._project_chunk_numpy(numpy,first,coords,counts,normals,lighting,tile_size,tiles_x)
+        w,h = self.img_size
+        records,offsets,bins = array.array("d"),array.array("i"),{}
+        p = 0
+        for i,n in enumerate(counts):
+            points = [(coords[k],coords[k+1],coords[k+2]) for k in range(p*3,(p+n)*3,3)]
+            p += n
+            sx,sy,sz = 0,0,0
+            for x,y,z in points: sx += x; sy += y; sz += z
+            key = math.sqrt((sx/n)**2+(sy/n)**2+(sz/n)**2) # Polygon3D.center().norm(), the drawing order
+            polygon_vertices,d,plane = self._prepare_points(points,normals[i*3:i*3+3],lighting)
+            zmin = self._polygon_zmin(polygon_vertices,min(z for _,_,z in points),plane)
+            offsets.append(len(records))
+            records.extend((key,d)+plane+(float("nan") if zmin is None else zmin,len(polygon_vertices)))
+            for v in polygon_vertices: records.extend(v)
+            xs,ys = [v[0] for v in polygon_vertices],[v[1] for v in polygon_vertices]
+            x0,x1 = max(min(xs),0)//tile_size,min(max(xs),w-1)//tile_size
+            y0,y1 = max(min(ys),0)//tile_size,min(max(ys),h-1)//tile_size
+            for ty in range(y0,y1+1):
+                for tx in range(x0,x1+1):
+                    tile = ty*tiles_x+tx
+                    if tile not in bins: bins[tile] = array.array("i")
+                    bins[tile].append(i)
+        return first,records,offsets,bins
+
+    def _project_chunk_numpy(self, np, first, coords, counts, normals, lighting, tile_size:int, tiles_x:int):
+        # _project_chunk with every polygon of the chunk at once, the records and bins come out identical
+        w,h = self.img_size
+        nearz,scale = self.nearz,self.scale
+        cx,cy = self.screenx*scale/2,self.screeny*scale/2
+        counts = np.frombuffer(counts,dtype=np.intc).astype(np.int64)
+        x,y,z = np.frombuffer(coords,dtype=float).reshape(-1,3).T
+        nx,ny,nz = np.frombuffer(normals,dtype=float).reshape(-1,3).T
+        starts = np.cumsum(counts)-counts
+        n = counts.astype(float)
+        sx,sy,sz = np.zeros(len(counts)),np.zeros(len(counts)),np.zeros(len(counts))
+        for j in range(int(counts.max())): # vertex by vertex, summed in the same order as the loop
+            has = counts>j
+            sx[has] += x[starts[has]+j]; sy[has] += y[starts[has]+j]; sz[has] += z[starts[has]+j]
+        # Point3D.norm() squares with python's float pow, which numpy's square does not always match to the last bit
+        key = [math.sqrt(a**2+b**2+c**2) for a,b,c in zip((sx/n).tolist(),(sy/n).tolist(),(sz/n).tolist())]
+        vx,vy = (x/z*nearz*scale+cx).astype(np.int64),(y/z*nearz*scale+cy).astype(np.int64)
+        d = np.trunc(255*(-(nx*lighting[0]+ny*lighting[1]+nz*lighting[2])*0.4+0.6))
+        plane_d = nx*x[starts]+ny*y[starts]+nz*z[starts]
+        xmin,xmax = np.minimum.reduceat(vx,starts),np.maximum.reduceat(vx,starts)
+        ymin,ymax = np.minimum.reduceat(vy,starts),np.maximum.reduceat(vy,starts)
+        corners = [] # _polygon_zmin: plane depth at the corners of the pixel box
+        with np.errstate(divide="ignore",invalid="ignore"):
+            for i in (xmin,xmax+1):
+                for j in (ymin,ymax+1):
+                    den = nx*((i-cx)/scale)+ny*((j-cy)/scale)+nz*nearz
+                    corners.append(np.where(den==0,np.inf,nearz*(plane_d/den)))
+        corners = np.array(corners)
+        zmin = np.minimum(np.minimum.reduceat(z,starts),corners.min(axis=0))
+        zmin[(corners.min(axis=0)<=0)|(corners.max(axis=0)==np.inf)] = np.nan
+        size = 8+2*counts
+        offsets = np.cumsum(size)-size
+        records = np.empty(int(size.sum()))
+        records[offsets[:,None]+np.arange(8)] = np.stack((key,d,nx,ny,nz,plane_d,zmin,n),axis=1)
+        slot = np.repeat(offsets+8-2*starts,counts)+2*np.arange(len(vx)) # vertex k of the chunk lands at its polygon's slot
+        records[slot],records[slot+1] = vx,vy
+        x0,x1 = np.maximum(xmin,0)//tile_size,np.minimum(xmax,w-1)//tile_size
+        y0,y1 = np.maximum(ymin,0)//tile_size,np.minimum(ymax,h-1)//tile_size
+        across,down = np.maximum(x1-x0+1,0),np.maximum(y1-y0+1,0)
+        spans = across*down
+        ids = np.repeat(np.arange(len(counts)),spans)
+        k = np.arange(len(ids))-np.repeat(np.cumsum(spans)-spans,spans)
+        tiles = (y0[ids]+k//np.maximum(across[ids],1))*tiles_x+x0[ids]+k%np.maximum(across[ids],1)
+        order = np.argsort(tiles,kind="stable") # ids stay in element order within a tile
+        tiles,ids = tiles[order],ids[order].astype(np.intc)
+        bounds = np.flatnonzero(np.concatenate(([True],tiles[1:]!=tiles[:-1],[True])))
+        bins = {}
+        for a,b in zip(bounds[:-1].tolist(),bounds[1:].tolist()):
+            bins[int(tiles[a])] = array.array("i",ids[a:b].tobytes())
+        return (first,array.array("d",records.tobytes()),array.array("i",offsets.astype(np.intc).tobytes()),bins)
+
+    def _rasterize_tiles(self, chunks, tiles):
+        # phase two, in a worker: chunks [(first, records, offsets)], tiles [(bounds, [(chunk, local ids)])]
+        results = []
+        for bounds,tile_bins in tiles:
+            polygons = []
+            for c,ids in tile_bins:
+                first,records,offsets = chunks[c]
+                for i in ids:
+                    o = offsets[i]
+                    n = int(records[o+7])
+                    vertices = [(int(records[k]),int(records[k+1])) for k in range(o+8,o+8+2*n,2)]
+                    zmin = records[o+6]
+                    polygons.append((records[o],first+i,vertices,int(records[o+1]),tuple(records[o+2:o+6]),None if zmin!=zmin else zmin))
+            polygons.sort(key=lambda x:(-x[0],x[1])) # far to near, element order on ties, as in the serial path
+            if self.occlusion_culling: polygons.reverse()
+            results.append(self._rasterize_tile(bounds,polygons))
+        return results
+
+    def _rasterize_tile(self, bounds, polygons):
+        x0,y0,x1,y1 = bounds
+        img = [[0]*(x1-x0) for _ in range(y1-y0)]
+        depth_map = [[float("inf")]*(x1-x0) for _ in range(y1-y0)]
+        hiz = HiZBuffer(depth_map,origin=(x0,y0)) if self.occlusion_culling else None
+        culled = array.array("i") # ids of the polygons culled in this tile
+        for _,i,polygon_vertices,d,plane,zmin in polygons:
+            if hiz is not None and zmin is not None:
+                xs,ys = [v[0] for v in polygon_vertices],[v[1] for v in polygon_vertices]
+                if hiz.occluded(min(xs),min(ys),max(xs),max(ys),zmin):
+                    culled.append(i)
+                    continue
+            pixels = self._fill_polygon(plane,polygon_vertices,img,d,depth_map,bounds,replace_ties=hiz is not None)
+            if hiz is not None and pixels: hiz.update(pixels)
+        return bounds,img,depth_map,culled
+
+    def _get_pool(self, processes:int=None): # kept alive across frames, the fork is the expensive part
+        key = (processes,pickle.dumps(self)) # workers hold a copy of the renderer, restart them when settings change
+        if getattr(self,"_pool",None) is None or self._pool_key!=key:
+            self.close()
+            self._pool = multiprocessing.Pool(processes,initializer=_init_tile_worker,initargs=(self,))
+            self._pool_key = key
+        return self._pool
+
+    def close(self):
+        if getattr(self,"_pool",None) is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __getstate__(self): # shipped to tile workers once, without the pool or per-frame stats
+        state = self.__dict__.copy()
+        for name in ("_pool","_pool_key","stats"): state.pop(name,None)
+        return state
+
+    def render_edges(self, obj:WavefrontObjOutline, img, depth_map):
+        color = self._color_value(obj.color)
+        projected = [self._image_point(p) for p in obj.points] # each shared vertex projected once
+        self._draw_lines([(projected[i],projected[j],color) for i,j in obj.edges],img,depth_map)
+
+    def _line_segments(self, elements): # Line3D elements as _draw_lines segments
+        return [(self._image_point(e.point1),self._image_point(e.point2),self._color_value(e.color)) for e in elements if isinstance(e,Line3D)]
+
+    def _image_point(self, point3d:Point3D): # (x,y) on image pixel and camera depth
+        if point3d.z<=0: return None
+        point2d = self.project_point3d(point3d)
+        return (point2d.x*self.scale+self.screenx*self.scale/2,point2d.y*self.scale+self.screeny*self.scale/2,point3d.z)
+
+    def _color_value(self, color) -> int:
+        if isinstance(color,str): return {"white":255,"black":0,"gray":128,"grey":128}.get(color,255)
+        return int(color)
+
+    def _draw_lines(self, segments, img, depth_map):
+        # segments [(p1,p2,color)] of image points, drawn together; every pixel takes the nearest sample passing the
+        # depth test, so the result does not depend on the order of the segments
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None: return self._draw_lines_numpy(numpy,segments,img,depth_map)
+        nearest = {}
+        for p1,p2,color in segments:
+            for px,py,z,a in self._line_samples(p1,p2):
+                sample = nearest.get((px,py))
+                if sample is None or z<sample[0] or (z==sample[0] and a>sample[1]): nearest[(px,py)] = (z,a,color)
+        bias = 1+self.line_depth_bias
+        for (px,py),(z,a,color) in nearest.items():
+            if z>depth_map[py][px]*bias: continue
+            img[py][px] = int(img[py][px]*(1-a)+color*a)
+            if a>=0.5 and z<depth_map[py][px]: depth_map[py][px] = z
+
+    def _line_samples(self, p1, p2): # (x,y,depth,coverage) of the pixels a line touches, wu samples when antialiased
+        if p1 is None or p2 is None: return # endpoint behind the camera
+        (x0,y0,z0),(x1,y1,z1) = p1,p2
+        steep = abs(y1-y0)>abs(x1-x0)
+        if steep: x0,y0,x1,y1 = y0,x0,y1,x1
+        if x0>x1: x0,y0,z0,x1,y1,z1 = x1,y1,z1,x0,y0,z0
+        w,h = self.img_size
+        if steep: w,h = h,w # iterate along the major axis
+        dx = x1-x0
+        gradient = (y1-y0)/dx if dx!=0 else 0
+        iz0,diz = 1/z0,1/z1-1/z0 # depth is interpolated perspective-correct
+        for x in range(max(int(round(x0)),0),min(int(round(x1)),w-1)+1):
+            t = min(max((x-x0)/dx,0),1) if dx!=0 else 0
+            y = y0+gradient*(x-x0)
+            z = 1/(iz0+diz*t)
+            if self.antialias:
+                yi = math.floor(y); f = y-yi
+                samples = ((yi,1-f),(yi+1,f))
+            else:
+                samples = ((int(round(y)),1),)
+            for yy,a in samples:
+                if a<=0 or yy<0 or yy>=h: continue
+                yield ((yy,x,z,a) if steep else (x,yy,z,a))
+
+    def _draw_lines_numpy(self, np, segments, img, depth_map): # _draw_lines with every sample of every segment at once
+        segments = [p1+p2+(color,) for p1,p2,color in segments if p1 is not None and p2 is not None]
+        if not segments: return
+        x0,y0,z0,x1,y1,z1,color = np.array(segments,dtype=float).T
+        steep = np.abs(y1-y0)>np.abs(x1-x0)
+        x0,y0,x1,y1 = np.where(steep,y0,x0),np.where(steep,x0,y0),np.where(steep,y1,x1),np.where(steep,x1,y1)
+        swap = x0>x1
+        x0,x1,y0,y1,z0,z1 = np.where(swap,x1,x0),np.where(swap,x0,x1),np.where(swap,y1,y0),np.where(swap,y0,y1),np.where(swap,z1,z0),np.where(swap,z0,z1)
+        w,h = self.img_size
+        major,minor = np.where(steep,h,w),np.where(steep,w,h)
+        dx = x1-x0
+        gradient = np.divide(y1-y0,dx,out=np.zeros_like(dx),where=dx!=0)
+        iz0 = 1/z0
+        diz = 1/z1-iz0
+        first = np.maximum(np.round(x0),0).astype(np.int64)
+        count = np.maximum(np.minimum(np.round(x1),major-1).astype(np.int64)-first+1,0)
+        seg = np.repeat(np.arange(len(count)),count)
+        x = (first[seg]+np.arange(len(seg))-np.repeat(np.cumsum(count)-count,count)).astype(float)
+        t = np.clip(np.divide(x-x0[seg],dx[seg],out=np.zeros_like(x),where=dx[seg]!=0),0,1)
+        y = y0[seg]+gradient[seg]*(x-x0[seg])
+        z = 1/(iz0[seg]+diz[seg]*t)
+        if self.antialias: # two samples per step, interleaved in the order the loop visits them
+            yi = np.floor(y); f = y-yi
+            yy,a = np.stack((yi,yi+1),axis=1).ravel(),np.stack((1-f,f),axis=1).ravel()
+            seg,x,z = np.repeat(seg,2),np.repeat(x,2),np.repeat(z,2)
+        else:
+            yy,a = np.round(y),np.ones_like(y)
+        keep = (a>0)&(yy>=0)&(yy<minor[seg])
+        seg,x,yy,z,a = seg[keep],x[keep].astype(np.int64),yy[keep].astype(np.int64),z[keep],a[keep]
+        px,py = np.where(steep[seg],yy,x),np.where(steep[seg],x,yy)
+        order = np.lexsort((-a,z,py*w+px)) # stable, ties keep the first sample like the loop
+        pixel = (py*w+px)[order]
+        nearest = order[np.concatenate(([True],pixel[1:]!=pixel[:-1]))]
+        px,py,z,a,c = px[nearest],py[nearest],z[nearest],a[nearest],color[seg[nearest]]
+        depth = np.array(depth_map,dtype=float)[py,px]
+        visible = z<=depth*(1+self.line_depth_bias)
+        px,py,z,a,c,depth = px[visible],py[visible],z[visible],a[visible],c[visible],depth[visible]
+        values = np.trunc(np.array(img,dtype=float)[py,px]*(1-a)+c*a).astype(np.int64)
+        for i,j,v in zip(px.tolist(),py.tolist(),values.tolist()): img[j][i] = v
+        write = (a>=0.5)&(z<depth)
+        for i,j,d in zip(px[write].tolist(),py[write].tolist(),z[write].tolist()): depth_map[j][i] = d
+
     def _polygon2d_sides(self, polygon2d:Polygon2D):
         points = polygon2d.points
         sides = [[(points[i].x,points[i].y),(points[i-1].x,points[i-1].y)] for i in range(len(points))]
@@ -306,4 +931,13 @@ class Renderer:
             if p_low[1]<=y and y<=p_high[1]:
                 intersect_x = self._interpolate_x(p_low,p_high,y)
                 if intersect_x>x: num += 1
-        return num%2==1
\ No newline at end of file
+        return num%2==1
+
+_tile_renderer = None # the renderer copy of a tile worker process, set once by the pool initializer
+
+def _init_tile_worker(renderer:Renderer):
+    global _tile_renderer
+    _tile_renderer = renderer
+
+def _run_in_tile_worker(method, task):
+    return method(_tile_renderer,*task)
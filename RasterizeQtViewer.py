@@ -8,7 +8,7 @@ import numpy as np
 import sys, Rasterize as Rasterize, math
 
 class QtViewer(QWidget):
-    def __init__(self, obj_filename=None):
+    def __init__(self, obj_filename=None, wireframe=False, tiled=False):
         super().__init__()
 
         self.canvas = QLabel()
@@ -21,15 +21,18 @@ class QtViewer(QWidget):
         self.vbox.setContentsMargins(0,0,0,0)
         self.setLayout(self.vbox)
         
+        self.title = "Cube" if obj_filename is None else obj_filename
         if obj_filename is None:
             self.obj = Rasterize.Cube(2)
+        elif wireframe:
+            self.obj = Rasterize.WavefrontObjOutline(obj_filename)
         else:
-            self.obj = Rasterize.WavefrontObj(obj_filename)
-            self.setWindowTitle(obj_filename)
+            self.obj = Rasterize.WavefrontObj(obj_filename,lod_levels=4)
         self.obj.translate(0,0,5)
         self.obj.rotate(self.obj.center,Rasterize.Point3D(1,0,0),math.pi)
         self.obj.rotate(self.obj.center,Rasterize.Point3D(0,1,0),math.pi/3)
         self.renderer = Rasterize.Renderer(6,4,5)
+        self.tiled = tiled # multi-process tile rasterizer
         self.lighting = Rasterize.Point3D(1,0,0)
         self.render()
 
@@ -38,7 +41,10 @@ class QtViewer(QWidget):
 
     def render(self):
         # self.canvas.setPixmap(self.pil2pixmap(img = self.renderer.render_object_rasterize(self.obj,self.lighting)))
-        self.canvas.setPixmap(self.matrix2pixmap(self.renderer.render_object_rasterize(self.obj,self.lighting)))
+        if self.tiled: img = self.renderer.render_object_rasterize_tiled(self.obj,self.lighting)
+        else: img = self.renderer.render_object_rasterize(self.obj,self.lighting)
+        self.canvas.setPixmap(self.matrix2pixmap(img))
+        self.setWindowTitle(f"{self.title} - {self.renderer.stats}")
 
     def keyPressEvent(self, e:QKeyEvent):
         if e.key()==Qt.Key.Key_Escape: quit()
@@ -89,9 +95,12 @@ class QtViewer(QWidget):
 
 if __name__ == "__main__":
     App = QApplication(sys.argv)
-    if len(sys.argv)==1:
-        window = QtViewer()
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args)==0:
+        window = QtViewer(tiled="--tiled" in sys.argv)
     else:
-        window = QtViewer(sys.argv[1])
+        window = QtViewer(args[0],"--wireframe" in sys.argv,"--tiled" in sys.argv)
     window.show()
-    sys.exit(App.exec())
+    ret = App.exec()
+    window.renderer.close()
+    sys.exit(ret)
@@ -35,32 +35,10 @@ def scene_cube(scene:Raytrace.Scene):
         )
     )
 
-    scene.add_object(RaycastableObject.Triangle(
-        LinAlg.Vector3(-10, 1, 0),
-        LinAlg.Vector3(10, 1, 0),
-        LinAlg.Vector3(10, 1, 10)
-    ))
-    scene.add_object(RaycastableObject.Triangle(
-        LinAlg.Vector3(-10, 1, 0),
-        LinAlg.Vector3(10, 1, 10),
-        LinAlg.Vector3(-10, 1, 10)
-    ))
-
-    p000 = LinAlg.Vector3(0, 0, 0) + LinAlg.Vector3(-2, 0, 4)
-    p001 = LinAlg.Vector3(0, 0, 1) + LinAlg.Vector3(-2, 0, 4)
-    p010 = LinAlg.Vector3(0, 1, 0) + LinAlg.Vector3(-2, 0, 4)
-    p011 = LinAlg.Vector3(0, 1, 1) + LinAlg.Vector3(-2, 0, 4)
-    p100 = LinAlg.Vector3(1, 0, 0) + LinAlg.Vector3(-2, 0, 4)
-    p101 = LinAlg.Vector3(1, 0, 1) + LinAlg.Vector3(-2, 0, 4)
-    p110 = LinAlg.Vector3(1, 1, 0) + LinAlg.Vector3(-2, 0, 4)
-    p111 = LinAlg.Vector3(1, 1, 1) + LinAlg.Vector3(-2, 0, 4)
+    scene.add_object(RaycastableObject.Plane(LinAlg.Vector3(0, 1, 0), LinAlg.Vector3(0, -1, 0))) # floor
+
     blue = Material.Material(LinAlg.Vector3(0.6, 0.7, 1))
-    scene.add_object(RaycastableObject.Parallelogram(p111, p101, p110, blue))
-    scene.add_object(RaycastableObject.Parallelogram(p110, p100, p010, blue))
-    scene.add_object(RaycastableObject.Parallelogram(p101, p001, p100, blue))
-    # scene.add_object(RaycastableObject.Parallelogram(p111, p110, p011, blue))
-    # scene.add_object(RaycastableObject.Parallelogram(p111, p011, p101, blue))
-    # scene.add_object(RaycastableObject.Parallelogram(p001, p011, p000, blue))
+    scene.add_object(RaycastableObject.Box(LinAlg.Vector3(-1.5, 0.5, 4.5), 1, 1, 1, blue))
 
 def scene_cornell_box(scene:Raytrace.Scene):
     # light
@@ -106,8 +84,12 @@ class RenderWorker(QObject):
 
         self.camera = Raytrace.Camera(self.scene, 5, 3, 3)
         self.camera.set_parameters(1, 10)
+        self.denoise = False
+        self.preview_steps = [8, 4, 2] # coarse passes shown right after the view changes
 
         self._stop = False
+        self._view_generation = 1 # bumped by every view change
+        self._rendered_generation = 0 # view the accumulated samples belong to
 
     def pil2pixmap(self, im:Image.Image) -> QPixmap: # function to convert pil image to pyqt pixmap
         return QPixmap.fromImage(QImage(im.tobytes("raw"), im.size[0], im.size[1], QImage.Format.Format_RGB888))
@@ -122,19 +104,41 @@ class RenderWorker(QObject):
         return self.pil2pixmap(m)
 
     def run(self):
-        self.camera.render()
-        pixmap = self.vector_matrix2pixmap(self.camera.get_img())
-        self.signal_render_result.emit(RenderResult(
-            pixmap,
-            self.camera.render_count,
-            sum(self.camera.render_time) / self.camera.render_count
-        ))
-        if not self._stop:
-            self.run()
+        while not self._stop:
+            generation = self._view_generation
+            if generation != self._rendered_generation:
+                # update_view bumps the generation before stopping the camera, so a cancel that lands before
+                # this resume is caught by the check below and one that lands after it stays set
+                self.camera.resume()
+                if self._view_generation != generation or self._stop: continue
+                self._rendered_generation = generation
+                self.camera.reset()
+                for step in self.preview_steps:
+                    img = self.camera.render_preview(step)
+                    if img is None or self._view_generation != generation: break
+                    self.signal_render_result.emit(RenderResult(self.vector_matrix2pixmap(img), 0, 0))
+                continue
+            self.camera.render()
+            if self._view_generation != generation or self._stop: continue # interrupted, samples are discarded by the restart
+            img = self.camera.get_img(denoise=self.denoise)
+            if img is None: continue # view changed during denoising
+            pixmap = self.vector_matrix2pixmap(img)
+            self.signal_render_result.emit(RenderResult(
+                pixmap,
+                self.camera.render_count,
+                sum(self.camera.render_time) / self.camera.render_count
+            ))
+
+    def update_view(self, move:LinAlg.Vector3=None, yaw:float=0, pitch:float=0, fov:float=0): # called from the gui thread
+        if move is not None: self.camera.move(move.z, move.x, move.y)
+        if yaw or pitch: self.camera.rotate(yaw, pitch)
+        if fov: self.camera.set_fov(self.camera.fov + fov)
+        self._view_generation += 1
+        self.camera.stop() # cancel the pass in flight, run() resumes the camera and restarts accumulation
 
     def stop(self):
-        self.camera.stop()
         self._stop = True
+        self.camera.stop()
 
 class QtViewer(QWidget):
     def __init__(self, obj_filename=None):
@@ -149,8 +153,11 @@ class QtViewer(QWidget):
         self.hbox.addStretch()
         self.button_save = QPushButton("Save Image")
         self.button_save.clicked.connect(self.save)
+        self.checkbox_denoise = QCheckBox("Denoise")
+        self.checkbox_denoise.toggled.connect(self.set_denoise)
         self.vbox.addWidget(self.label_render_count)
         self.vbox.addLayout(self.hbox)
+        self.vbox.addWidget(self.checkbox_denoise)
         self.vbox.addWidget(self.button_save)
         self.vbox.setContentsMargins(0,0,0,0)
         self.setLayout(self.vbox)
@@ -164,11 +171,52 @@ class QtViewer(QWidget):
 
         self.img = QPixmap()
 
+        self.move_step = 0.2
+        self.turn_step = 0.05
+        self.mouse_sensitivity = 0.005
+        self.mouse_press_pos = None
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
     def display_result(self, render_result:RenderResult):
-        self.label_render_count.setText(f"Render count: {render_result.render_count}; Avg spf: {'%.2f'%render_result.spf}")
+        if render_result.render_count == 0:
+            self.label_render_count.setText("Preview")
+        else:
+            self.label_render_count.setText(f"Render count: {render_result.render_count}; Avg spf: {'%.2f'%render_result.spf}")
         self.img = render_result.pixmap
         self.canvas.setPixmap(render_result.pixmap)
 
+    def keyPressEvent(self, e:QKeyEvent):
+        k = self.move_step
+        if e.key()==Qt.Key.Key_Escape: self.close(); quit()
+        elif e.key()==Qt.Key.Key_W: self.worker.update_view(move=LinAlg.Vector3(0, 0, k))
+        elif e.key()==Qt.Key.Key_S: self.worker.update_view(move=LinAlg.Vector3(0, 0, -k))
+        elif e.key()==Qt.Key.Key_A: self.worker.update_view(move=LinAlg.Vector3(-k, 0, 0))
+        elif e.key()==Qt.Key.Key_D: self.worker.update_view(move=LinAlg.Vector3(k, 0, 0))
+        elif e.key()==Qt.Key.Key_E: self.worker.update_view(move=LinAlg.Vector3(0, -k, 0))
+        elif e.key()==Qt.Key.Key_Q: self.worker.update_view(move=LinAlg.Vector3(0, k, 0))
+        elif e.key()==Qt.Key.Key_Left: self.worker.update_view(yaw=-self.turn_step)
+        elif e.key()==Qt.Key.Key_Right: self.worker.update_view(yaw=self.turn_step)
+        elif e.key()==Qt.Key.Key_Up: self.worker.update_view(pitch=self.turn_step)
+        elif e.key()==Qt.Key.Key_Down: self.worker.update_view(pitch=-self.turn_step)
+        elif e.key()==Qt.Key.Key_Equal: self.worker.update_view(fov=-self.turn_step)
+        elif e.key()==Qt.Key.Key_Minus: self.worker.update_view(fov=self.turn_step)
+
+    def mousePressEvent(self, event:QMouseEvent):
+        self.mouse_press_pos = (event.pos().x(), event.pos().y())
+
+    def mouseMoveEvent(self, event:QMouseEvent):
+        if self.mouse_press_pos:
+            x, y = event.pos().x(), event.pos().y()
+            dx, dy = x - self.mouse_press_pos[0], y - self.mouse_press_pos[1]
+            self.mouse_press_pos = (x, y)
+            self.worker.update_view(yaw=dx * self.mouse_sensitivity, pitch=-dy * self.mouse_sensitivity)
+
+    def mouseReleaseEvent(self, event:QMouseEvent):
+        self.mouse_press_pos = None
+
+    def set_denoise(self, checked:bool):
+        self.worker.denoise = checked # picked up on the next frame
+
     def save(self):
         self.img.save("output.png")
 
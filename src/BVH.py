@@ -1,2 +1,136 @@
-import math
-import Ray, LinAlg
\ No newline at end of file
+import typing
+from . import LinAlg, Ray
+
+class AABB:
+    def __init__(self, lo:LinAlg.Vector3, hi:LinAlg.Vector3):
+        self.lo = lo
+        self.hi = hi
+
+    def union(self, other:"AABB") -> "AABB":
+        return AABB(
+            LinAlg.Vector3(min(self.lo.x, other.lo.x), min(self.lo.y, other.lo.y), min(self.lo.z, other.lo.z)),
+            LinAlg.Vector3(max(self.hi.x, other.hi.x), max(self.hi.y, other.hi.y), max(self.hi.z, other.hi.z))
+        )
+
+    def center(self) -> LinAlg.Vector3:
+        return (self.lo + self.hi) * 0.5
+
+    def corners(self) -> typing.List[LinAlg.Vector3]:
+        return [LinAlg.Vector3(x, y, z) for x in (self.lo.x, self.hi.x) for y in (self.lo.y, self.hi.y) for z in (self.lo.z, self.hi.z)]
+
+    def __repr__(self):
+        return f"AABB({self.lo}, {self.hi})"
+
+    @staticmethod
+    def from_points(points:typing.List[LinAlg.Vector3], padding:float=0) -> "AABB":
+        return AABB(
+            LinAlg.Vector3(min(p.x for p in points) - padding, min(p.y for p in points) - padding, min(p.z for p in points) - padding),
+            LinAlg.Vector3(max(p.x for p in points) + padding, max(p.y for p in points) + padding, max(p.z for p in points) + padding)
+        )
+
+class BVHNode:
+    def __init__(self, bounds:AABB, left:"BVHNode"=None, right:"BVHNode"=None, objects:list=None):
+        self.bounds = bounds
+        self.left = left
+        self.right = right
+        self.objects = objects # only set on leaves
+        self.parent = None
+        self.depth = 0
+        self._set_box()
+
+    def _set_box(self): # flattened bounds for the traversal loop
+        lo, hi = self.bounds.lo, self.bounds.hi
+        self.box = (lo.x, lo.y, lo.z, hi.x, hi.y, hi.z)
+
+    def refit(self):
+        if self.objects is not None:
+            bounds = self.objects[0].bounds()
+            for obj in self.objects[1:]: bounds = bounds.union(obj.bounds())
+        else:
+            bounds = self.left.bounds.union(self.right.bounds)
+        self.bounds = bounds
+        self._set_box()
+
+class BVH: # bounding volume hierarchy over objects exposing bounds() and hit(ray)
+    def __init__(self, objects:list, leaf_size:int=2):
+        self.leaf_size = leaf_size
+        self.unbounded = [obj for obj in objects if obj.bounds() is None] # tested on every ray
+        self._leaf_of = {} # id(object) -> leaf, used by partial refits
+        bounded = [(obj, obj.bounds()) for obj in objects if obj.bounds() is not None]
+        self.root = self._build(bounded) if bounded else None
+
+    def _build(self, items, depth:int=0) -> BVHNode:
+        bounds = items[0][1]
+        for _, b in items[1:]: bounds = bounds.union(b)
+        if len(items) <= self.leaf_size:
+            node = BVHNode(bounds, objects=[obj for obj, _ in items])
+            node.depth = depth
+            for obj, _ in items: self._leaf_of[id(obj)] = node
+            return node
+        centers = [b.center() for _, b in items]
+        extent = AABB.from_points(centers)
+        size = extent.hi - extent.lo
+        axis = max(("x", "y", "z"), key=lambda a: getattr(size, a))
+        order = sorted(range(len(items)), key=lambda i: getattr(centers[i], axis)) # median split on widest axis
+        mid = len(items) // 2
+        left = self._build([items[i] for i in order[:mid]], depth + 1)
+        right = self._build([items[i] for i in order[mid:]], depth + 1)
+        node = BVHNode(bounds, left, right)
+        node.depth = depth
+        left.parent = right.parent = node
+        return node
+
+    def contains(self, obj) -> bool:
+        return id(obj) in self._leaf_of or any(o is obj for o in self.unbounded)
+
+    def refit(self, objects:list=None): # recompute bounds after objects moved, without rebuilding
+        if self.root is None: return
+        if objects is None:
+            self._refit_all(self.root)
+            return
+        nodes = {} # every ancestor of a dirty leaf, refit once each, deepest first
+        for obj in objects:
+            node = self._leaf_of.get(id(obj))
+            while node is not None and id(node) not in nodes:
+                nodes[id(node)] = node
+                node = node.parent
+        for node in sorted(nodes.values(), key=lambda n: n.depth, reverse=True):
+            node.refit()
+
+    def _refit_all(self, node:BVHNode):
+        if node.objects is None:
+            self._refit_all(node.left)
+            self._refit_all(node.right)
+        node.refit()
+
+    def hit(self, ray:Ray.Ray, closest): # closest: RayHitInfo to improve upon, usually RayHitInfo.empty()
+        for obj in self.unbounded:
+            hitinfo = obj.hit(ray)
+            if hitinfo.t < closest.t: closest = hitinfo
+        if self.root is None: return closest
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        D = ray.direction
+        ix = 1 / D.x if D.x != 0 else 1e30
+        iy = 1 / D.y if D.y != 0 else 1e30
+        iz = 1 / D.z if D.z != 0 else 1e30
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            x0, y0, z0, x1, y1, z1 = node.box
+            tx0, tx1 = (x0 - ox) * ix, (x1 - ox) * ix
+            if tx0 > tx1: tx0, tx1 = tx1, tx0
+            ty0, ty1 = (y0 - oy) * iy, (y1 - oy) * iy
+            if ty0 > ty1: ty0, ty1 = ty1, ty0
+            tz0, tz1 = (z0 - oz) * iz, (z1 - oz) * iz
+            if tz0 > tz1: tz0, tz1 = tz1, tz0
+            tmin = max(tx0, ty0, tz0)
+            tmax = min(tx1, ty1, tz1)
+            if tmax < 0 or tmin > tmax or tmin > closest.t: continue
+            if node.objects is not None:
+                for obj in node.objects:
+                    hitinfo = obj.hit(ray)
+                    if hitinfo.t < closest.t: closest = hitinfo
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+        return closest
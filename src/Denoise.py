@@ -0,0 +1,124 @@
+import math, typing
+from . import LinAlg
+
+# edge-avoiding a-trous wavelet filter guided by the first-hit albedo, normal and depth buffers
+# vectorized with numpy when it is installed, otherwise buffers are flattened to per-channel lists
+# so the inner loop only touches floats
+
+_KERNEL = (1/16, 1/4, 3/8, 1/4, 1/16) # B3 spline
+
+def _flatten(grid, w, h):
+    xs, ys, zs = [0.0]*(w*h), [0.0]*(w*h), [0.0]*(w*h)
+    for y in range(h):
+        row, o = grid[y], y*w
+        for x in range(w):
+            v = row[x]
+            xs[o + x] = v.x; ys[o + x] = v.y; zs[o + x] = v.z
+    return xs, ys, zs
+
+def atrous(img:typing.List[typing.List[LinAlg.Vector3]],
+    albedo:typing.List[typing.List[LinAlg.Vector3]],
+    normal:typing.List[typing.List[LinAlg.Vector3]],
+    depth:typing.List[typing.List[float]],
+    iterations:int=4,
+    sigma_color:float=8,
+    sigma_normal:float=64,
+    sigma_depth:float=0.2,
+    cancelled:typing.Callable[[], bool]=None
+) -> typing.List[typing.List[LinAlg.Vector3]]:
+    # cancelled is polled between passes, a cancelled filter returns None
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        return _atrous_numpy(numpy, img, albedo, normal, depth, iterations, sigma_color, sigma_normal, sigma_depth, cancelled)
+    h, w = len(img), len(img[0])
+    n = w * h
+    ax, ay, az = _flatten(albedo, w, h)
+    nx, ny, nz = _flatten(normal, w, h)
+    for i in range(n): # accumulated normals are averages, renormalize them
+        l = math.sqrt(nx[i]*nx[i] + ny[i]*ny[i] + nz[i]*nz[i])
+        if l > 0: nx[i] /= l; ny[i] /= l; nz[i] /= l
+    d = [depth[y][x] for y in range(h) for x in range(w)]
+
+    # filter illumination only, texture detail is restored from the albedo afterwards
+    cx, cy, cz = _flatten(img, w, h)
+    eps = 1e-3
+    for i in range(n):
+        cx[i] /= ax[i] + eps; cy[i] /= ay[i] + eps; cz[i] /= az[i] + eps
+
+    for it in range(iterations):
+        if cancelled is not None and cancelled(): return None
+        step = 1 << it
+        inv_sc = 1 / (sigma_color * sigma_color * (0.5 ** it) + 1e-12) # tighten color weight on wider passes
+        inv_sd = 1 / (sigma_depth * step)
+        taps = [(dx * step, dy * step, _KERNEL[dx + 2] * _KERNEL[dy + 2]) for dy in range(-2, 3) for dx in range(-2, 3)]
+        ox, oy, oz = [0.0]*n, [0.0]*n, [0.0]*n
+        for y in range(h):
+            for x in range(w):
+                p = y*w + x
+                pcx, pcy, pcz = cx[p], cy[p], cz[p]
+                pnx, pny, pnz, pd = nx[p], ny[p], nz[p], d[p]
+                sx = sy = sz = ws = 0.0
+                for dx, dy, k in taps:
+                    qx, qy = x + dx, y + dy
+                    if qx < 0 or qx >= w or qy < 0 or qy >= h: continue
+                    q = qy*w + qx
+                    ex, ey, ez = cx[q] - pcx, cy[q] - pcy, cz[q] - pcz
+                    wc = -(ex*ex + ey*ey + ez*ez) * inv_sc
+                    wd = -abs(d[q] - pd) * inv_sd
+                    nd = pnx*nx[q] + pny*ny[q] + pnz*nz[q]
+                    if pnx or pny or pnz:
+                        if nd <= 0: continue
+                        wn = nd ** sigma_normal
+                    else:
+                        wn = 1.0 # background pixels carry no normal
+                    wq = k * wn * math.exp(max(wc + wd, -50))
+                    sx += cx[q] * wq; sy += cy[q] * wq; sz += cz[q] * wq; ws += wq
+                ox[p], oy[p], oz[p] = sx / ws, sy / ws, sz / ws
+        cx, cy, cz = ox, oy, oz
+
+    return [[LinAlg.Vector3(
+        cx[y*w + x] * (ax[y*w + x] + eps),
+        cy[y*w + x] * (ay[y*w + x] + eps),
+        cz[y*w + x] * (az[y*w + x] + eps)
+    ) for x in range(w)] for y in range(h)]
+
+def _atrous_numpy(np, img, albedo, normal, depth, iterations, sigma_color, sigma_normal, sigma_depth, cancelled):
+    # same filter with every tap applied to the whole image at once
+    vectors = lambda grid: np.array([[v.to_tuple() for v in row] for row in grid], dtype=float)
+    a, n, d = vectors(albedo), vectors(normal), np.array(depth, dtype=float)
+    h, w = d.shape
+    length = np.sqrt((n * n).sum(axis=2, keepdims=True))
+    n = np.divide(n, length, out=n.copy(), where=length > 0)
+    has_normal = (n != 0).any(axis=2)
+    eps = 1e-3
+    c = vectors(img) / (a + eps)
+
+    for it in range(iterations):
+        if cancelled is not None and cancelled(): return None
+        step = 1 << it
+        inv_sc = 1 / (sigma_color * sigma_color * (0.5 ** it) + 1e-12)
+        inv_sd = 1 / (sigma_depth * step)
+        s, ws = np.zeros_like(c), np.zeros((h, w))
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                ox, oy = dx * step, dy * step
+                if abs(ox) >= w or abs(oy) >= h: continue
+                p = (slice(max(-oy, 0), h - max(oy, 0)), slice(max(-ox, 0), w - max(ox, 0))) # pixels with the tap inside
+                q = (slice(max(oy, 0), h + min(oy, 0)), slice(max(ox, 0), w + min(ox, 0)))
+                e = c[q] - c[p]
+                e *= e
+                wc = -(e[..., 0] + e[..., 1] + e[..., 2]) * inv_sc
+                wd = -np.abs(d[q] - d[p]) * inv_sd
+                n_p, n_q = n[p], n[q]
+                nd = n_p[..., 0] * n_q[..., 0] + n_p[..., 1] * n_q[..., 1] + n_p[..., 2] * n_q[..., 2]
+                wn = np.where(has_normal[p], np.where(nd > 0, np.maximum(nd, 0) ** sigma_normal, 0.0), 1.0)
+                wq = _KERNEL[dx + 2] * _KERNEL[dy + 2] * wn * np.exp(np.maximum(wc + wd, -50))
+                s[p] += c[q] * wq[..., None]
+                ws[p] += wq
+        c = s / ws[..., None]
+
+    out = c * (a + eps)
+    return [[LinAlg.Vector3(*v) for v in row] for row in out.tolist()]
@@ -0,0 +1,258 @@
+import array, os, pickle, queue, random, socket, struct, subprocess, sys, threading, time
+from . import LinAlg, Raytrace
+
+# coordinator/worker tile rendering over tcp
+# the job and tile messages are length-prefixed pickles, so workers must trust the coordinator they connect to
+# results come back as a struct header and raw little-endian doubles, the coordinator never unpickles worker data
+# it listens on localhost by default, pass host="0.0.0.0" to take remote workers on a trusted network
+#
+#   coordinator: Coordinator(camera).render(passes=4, local_workers=2)
+#   worker:      python -m src.Distributed worker <host> <port>
+
+RESULT_HEADER = struct.Struct("!QQ") # tile index, payload size in bytes
+
+def send_message(sock:socket.socket, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack("!Q", len(data)) + data)
+
+def send_raw(sock:socket.socket, data:bytes): # an already pickled message, e.g. the job sent to every worker
+    sock.sendall(struct.pack("!Q", len(data)) + data)
+
+def recv_message(sock:socket.socket):
+    size, = struct.unpack("!Q", _recv_exact(sock, 8))
+    return pickle.loads(_recv_exact(sock, size))
+
+def send_result(sock:socket.socket, index:int, data:bytes):
+    sock.sendall(RESULT_HEADER.pack(index, len(data)) + data)
+
+def recv_result(sock:socket.socket, expected_size:int): # (tile index, raw doubles), refuses any other payload size
+    index, size = RESULT_HEADER.unpack(_recv_exact(sock, RESULT_HEADER.size))
+    if size != expected_size: raise ValueError(f"result of {size} bytes, expected {expected_size}")
+    return index, _recv_exact(sock, size)
+
+def _recv_exact(sock:socket.socket, n:int) -> bytes:
+    chunks = bytearray()
+    while len(chunks) < n:
+        chunk = sock.recv(min(n - len(chunks), 1 << 20))
+        if not chunk: raise ConnectionError("connection closed")
+        chunks += chunk
+    return bytes(chunks)
+
+def render_tile(camera:Raytrace.Camera, bounds, seed:int) -> bytes:
+    # one pass over the tile: color, albedo, normal and depth per pixel, packed as doubles
+    random.seed(seed)
+    x0, y0, x1, y1 = bounds
+    out = array.array("d")
+    for y in range(y0, y1):
+        for x in range(x0, x1):
+            color, albedo, normal, depth = camera.sample_pixel(x, y)
+            out.extend(color.to_tuple() + albedo.to_tuple() + normal.to_tuple() + (depth,))
+    if sys.byteorder == "big": out.byteswap()
+    return out.tobytes()
+
+class WorkItem:
+    def __init__(self, index:int, bounds, render_pass:int):
+        self.index = index
+        self.bounds = bounds
+        self.render_pass = render_pass
+        self.attempts = 0
+
+class Coordinator:
+    def __init__(self, camera:Raytrace.Camera, host:str="127.0.0.1", port:int=0, tile_size:int=32,
+        max_retries:int=3, tile_timeout:float=600, seed:int=0, worker_grace:float=30
+    ):
+        self.camera = camera
+        self.tile_size = tile_size
+        self.max_retries = max_retries
+        self.tile_timeout = tile_timeout # a worker silent for longer is treated as failed
+        self.seed = seed
+        self.worker_grace = worker_grace # how long work may sit with no worker connected before giving up
+        self.host = host
+        self.port = port
+        self.server = None
+        self._listen() # bound up front so self.port is known before render, closed again when a render returns
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._error = None
+        self._connected = 0 # workers currently holding a connection
+        self._idle_since = None # when the last worker disconnected, None while any is connected
+        self._workers = [] # (socket, serving thread) of every connection accepted during the current render
+
+    def _listen(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+
+    def _shutdown(self, accept_thread:threading.Thread):
+        # stops accepting, disconnects every worker and joins their threads, nothing is served between renders
+        self._done.set()
+        try:
+            self.server.shutdown(socket.SHUT_RDWR) # wakes the accept() blocked in the accept thread
+        except OSError:
+            pass
+        self.server.close()
+        self.server = None
+        accept_thread.join()
+        for sock, _ in self._workers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for _, thread in self._workers: thread.join()
+        self._workers = []
+
+    def render(self, passes:int=1, local_workers:int=0, wait_timeout:float=None):
+        # blocks until every tile of every pass is merged into camera.img, then returns the camera
+        camera = self.camera
+        if self.server is None: self._listen()
+        if camera.img is None: camera._allocate_buffers()
+        w, h = camera.width_pixels, camera.height_pixels
+        items = [
+            WorkItem(i, (x0, y0, min(x0 + self.tile_size, w), min(y0 + self.tile_size, h)), p)
+            for i, (p, y0, x0) in enumerate(
+                (p, y0, x0) for p in range(passes) for y0 in range(0, h, self.tile_size) for x0 in range(0, w, self.tile_size)
+            )
+        ]
+        self._queue = queue.Queue()
+        for item in items: self._queue.put(item)
+        self._remaining = len(items)
+        self._done.clear()
+        self._error = None
+        self._idle_since = None
+        self._job = pickle.dumps(("job", camera), pickle.HIGHEST_PROTOCOL) # scene and view serialized once
+        self._seed_offset = camera.render_count * (len(items) // max(passes, 1)) # later calls draw fresh samples
+        render_time_start = time.time()
+
+        accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        accept_thread.start()
+        processes = [spawn_local_worker("127.0.0.1", self.port) for _ in range(local_workers)]
+        try:
+            self._wait(processes, wait_timeout)
+        except BaseException:
+            for process in processes: process.kill()
+            raise
+        finally:
+            self._shutdown(accept_thread)
+            for process in processes: process.wait(timeout=30)
+        camera.render_count += passes
+        camera.render_time.append(time.time() - render_time_start)
+        return camera
+
+    def _wait(self, processes:list, wait_timeout:float):
+        # restarts local workers that exit early and fails instead of waiting forever on orphaned work
+        deadline = None if wait_timeout is None else time.time() + wait_timeout
+        restarts = 0
+        while not self._done.wait(0.5):
+            if deadline is not None and time.time() > deadline: raise TimeoutError("distributed render did not finish")
+            for i, process in enumerate(processes):
+                if process.poll() is None: continue
+                if restarts >= self.max_retries * len(processes):
+                    raise RuntimeError(f"local workers exited {restarts + 1} times")
+                restarts += 1
+                processes[i] = spawn_local_worker("127.0.0.1", self.port)
+            with self._lock:
+                idle_since = self._idle_since
+            if not processes and idle_since is not None and time.time() - idle_since > self.worker_grace:
+                raise RuntimeError(f"no workers connected for {self.worker_grace}s with {self._remaining} tiles left")
+        if self._error is not None: raise self._error
+
+    def _accept_loop(self):
+        while not self._done.is_set():
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return # server shut down
+            thread = threading.Thread(target=self._serve_worker, args=(sock,), daemon=True)
+            self._workers.append((sock, thread))
+            thread.start()
+
+    def _serve_worker(self, sock:socket.socket):
+        item = None
+        with self._lock:
+            self._connected += 1
+            self._idle_since = None
+        try:
+            sock.settimeout(self.tile_timeout)
+            send_raw(sock, self._job)
+            while not self._done.is_set():
+                try:
+                    item = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue # tiles may still come back from failing workers
+                item.attempts += 1
+                send_message(sock, ("tile", item.index, item.bounds, self.seed * 1000003 + self._seed_offset + item.index))
+                x0, y0, x1, y1 = item.bounds
+                index, data = recv_result(sock, 80 * (x1 - x0) * (y1 - y0))
+                if index != item.index: raise ConnectionError("unexpected reply")
+                self._merge(item, data)
+                item = None
+            send_message(sock, ("done",))
+        except Exception as e: # any bad reply or dropped connection, an escaping error would strand the tile
+            if item is not None: self._retry(item, e) # hand the tile to another worker
+        finally:
+            sock.close()
+            with self._lock:
+                self._connected -= 1
+                if self._connected == 0: self._idle_since = time.time()
+
+    def _retry(self, item:WorkItem, error:Exception):
+        if item.attempts > self.max_retries:
+            self._error = RuntimeError(f"tile {item.bounds} failed {item.attempts} times: {error}")
+            self._done.set()
+        else:
+            self._queue.put(item)
+
+    def _merge(self, item:WorkItem, data:bytes): # adds one pass of a tile into the camera's accumulation buffers
+        values = array.array("d")
+        values.frombytes(data)
+        if sys.byteorder == "big": values.byteswap()
+        camera = self.camera
+        x0, y0, x1, y1 = item.bounds
+        if len(values) != 10 * (x1 - x0) * (y1 - y0): # checked before anything is added, so a retry starts clean
+            raise ValueError(f"tile {item.bounds} result has {len(values)} values")
+        with self._lock:
+            i = 0
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    v = values[i:i + 10]
+                    camera.img[y][x] += LinAlg.Vector3(v[0], v[1], v[2])
+                    camera.albedo[y][x] += LinAlg.Vector3(v[3], v[4], v[5])
+                    camera.normal[y][x] += LinAlg.Vector3(v[6], v[7], v[8])
+                    camera.depth_buffer[y][x] += v[9]
+                    i += 10
+            self._remaining -= 1
+            if self._remaining == 0: self._done.set()
+
+def run_worker(host:str, port:int, connect_timeout:float=30):
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            if time.time() > deadline: raise
+            time.sleep(0.2)
+    try:
+        _, camera = recv_message(sock)
+        camera.scene.update() # build the acceleration structures once per job
+        while True:
+            message = recv_message(sock)
+            if message[0] == "done": return
+            _, index, bounds, seed = message
+            send_result(sock, index, render_tile(camera, bounds, seed))
+    except ConnectionError:
+        return # coordinator finished or went away
+    finally:
+        sock.close()
+
+def spawn_local_worker(host:str, port:int) -> subprocess.Popen:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, "-m", "src.Distributed", "worker", host, str(port)], cwd=root)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "worker":
+        run_worker(sys.argv[2], int(sys.argv[3]))
+    else:
+        print("usage: python -m src.Distributed worker <host> <port>")
@@ -0,0 +1,135 @@
+import abc, bisect, math, random, typing
+from . import LinAlg
+
+# directions follow the scene convention: -y is up, +z is forward
+
+class Environment(abc.ABC): # radiance seen by rays that escape the scene
+    @abc.abstractmethod
+    def get(self, D:LinAlg.Vector3) -> LinAlg.Vector3:
+        pass
+
+class SkyGradient(Environment): # depends on elevation only, tabulated over D.y of normalized directions
+    def __init__(self, strength:float=0.3, resolution:int=4096, interpolate:bool=False):
+        self.strength = strength
+        self.resolution = resolution
+        self.interpolate = interpolate
+        self.values = [self.evaluate(2 * i / (resolution - 1) - 1) for i in range(resolution)]
+        self.table = [LinAlg.Vector3(c) for c in self.values] # shared results, Vector3 ops never mutate in place
+        self._scale = (resolution - 1) / 2
+
+    def evaluate(self, y:float) -> float: # exact gradient, only used to fill the table
+        h = math.sqrt(max(1 - y*y, 0))
+        if h == 0: return 0 if y > 0 else self.strength
+        ratio = y / h
+        if ratio > 10: return 0
+        return 1 / (1 + math.exp(ratio)) * self.strength
+
+    def get(self, D:LinAlg.Vector3) -> LinAlg.Vector3:
+        f = (D.y + 1) * self._scale
+        if f <= 0: return self.table[0]
+        if f >= self.resolution - 1: return self.table[-1]
+        if not self.interpolate: return self.table[int(f + 0.5)]
+        i = int(f)
+        c0 = self.values[i]
+        return LinAlg.Vector3(c0 + (self.values[i + 1] - c0) * (f - i))
+
+class ImageEnvironment(Environment): # equirectangular environment map, mip-mapped and importance sampled
+    def __init__(self, filename:str, strength:float=1.0, gamma:float=2.2):
+        from PIL import Image
+        im = Image.open(filename).convert("RGB")
+        w, h = im.size
+        data = im.tobytes()
+        level = []
+        for y in range(h):
+            row = []
+            for x in range(w):
+                i = (y * w + x) * 3
+                row.append(tuple((data[i + k] / 255) ** gamma * strength for k in range(3)))
+            level.append(row)
+        self.levels = [level]
+        while len(level) > 1 and len(level[0]) > 1:
+            level = self._downsample(level)
+            self.levels.append(level)
+        self._build_distribution()
+
+    def _downsample(self, level):
+        h, w = len(level) // 2, len(level[0]) // 2
+        result = []
+        for y in range(h):
+            r0, r1 = level[2*y], level[2*y + 1]
+            row = []
+            for x in range(w):
+                a, b, c, d = r0[2*x], r0[2*x + 1], r1[2*x], r1[2*x + 1]
+                row.append(((a[0]+b[0]+c[0]+d[0]) * 0.25, (a[1]+b[1]+c[1]+d[1]) * 0.25, (a[2]+b[2]+c[2]+d[2]) * 0.25))
+            result.append(row)
+        return result
+
+    def _uv(self, D:LinAlg.Vector3):
+        u = math.atan2(D.x, D.z) / (2 * math.pi) + 0.5
+        v = math.acos(max(-1, min(1, -D.y))) / math.pi
+        return u, v
+
+    def _direction(self, u:float, v:float) -> LinAlg.Vector3:
+        phi = (u - 0.5) * 2 * math.pi
+        theta = v * math.pi
+        s = math.sin(theta)
+        return LinAlg.Vector3(s * math.sin(phi), -math.cos(theta), s * math.cos(phi))
+
+    def get(self, D:LinAlg.Vector3, level:int=0) -> LinAlg.Vector3: # bilinear lookup, higher level = blurrier
+        img = self.levels[min(level, len(self.levels) - 1)]
+        h, w = len(img), len(img[0])
+        u, v = self._uv(D)
+        fx, fy = u * w - 0.5, min(max(v * h - 0.5, 0), h - 1)
+        x0, y0 = math.floor(fx), int(fy)
+        tx, ty = fx - x0, fy - y0
+        x0 %= w; x1 = (x0 + 1) % w; y1 = min(y0 + 1, h - 1)
+        a, b, c, d = img[y0][x0], img[y0][x1], img[y1][x0], img[y1][x1]
+        return LinAlg.Vector3(*(
+            (a[k] * (1 - tx) + b[k] * tx) * (1 - ty) + (c[k] * (1 - tx) + d[k] * tx) * ty
+            for k in range(3)
+        ))
+
+    def _build_distribution(self, max_width:int=256):
+        level = 0 # sample on a reduced level so the tables stay small
+        while len(self.levels[level][0]) > max_width and level < len(self.levels) - 1: level += 1
+        img = self.levels[level]
+        h, w = len(img), len(img[0])
+        self._dist_size = (w, h)
+        self._conditional_cdf = []
+        row_weights = []
+        for y in range(h):
+            sin_theta = math.sin((y + 0.5) / h * math.pi)
+            cdf, s = [], 0
+            for p in img[y]:
+                s += (0.2126 * p[0] + 0.7152 * p[1] + 0.0722 * p[2]) * sin_theta
+                cdf.append(s)
+            if s == 0: cdf = [x + 1 for x in range(w)]; s = w * 1e-12
+            self._conditional_cdf.append([c / cdf[-1] for c in cdf])
+            row_weights.append(s)
+        total = sum(row_weights) or 1
+        self._marginal_cdf, s = [], 0
+        for r in row_weights:
+            s += r / total
+            self._marginal_cdf.append(s)
+        self._row_pdf = [r / total for r in row_weights]
+
+    def sample(self) -> typing.Tuple[LinAlg.Vector3, float]: # (direction, solid angle pdf), proportional to luminance
+        w, h = self._dist_size
+        y = min(bisect.bisect_left(self._marginal_cdf, random.random()), h - 1)
+        cdf = self._conditional_cdf[y]
+        x = min(bisect.bisect_left(cdf, random.random()), w - 1)
+        u, v = (x + random.random()) / w, (y + random.random()) / h
+        return self._direction(u, v), self.pdf_uv(x, y, v)
+
+    def pdf(self, D:LinAlg.Vector3) -> float:
+        w, h = self._dist_size
+        u, v = self._uv(D)
+        return self.pdf_uv(min(int(u * w), w - 1), min(int(v * h), h - 1), v)
+
+    def pdf_uv(self, x:int, y:int, v:float) -> float:
+        w, h = self._dist_size
+        cdf = self._conditional_cdf[y]
+        p = self._row_pdf[y] * (cdf[x] - (cdf[x - 1] if x > 0 else 0)) * w * h
+        sin_theta = math.sin(v * math.pi)
+        if sin_theta == 0: return 0
+        return p / (2 * math.pi * math.pi * sin_theta)
@@ -0,0 +1,268 @@
+import asyncio, concurrent.futures, hashlib, itertools, json, os, socket, typing
+from . import Environment, LinAlg, Material, Raytrace, RaycastableObject
+
+# local render job service: json lines over a localhost socket, jobs run on a process pool
+# results are ppm/pgm files in a content-addressed cache, keyed by the job and the mtimes of the files it reads
+#
+#   python -m src.JobService serve --port 8765 --cache .render_cache --workers 2
+#   submit({"kind": "raytrace", "scene": {...}, "camera": {...}}) -> {"status": "done", "path": ..., "cached": ...}
+#
+# raytrace job:
+#   {"kind": "raytrace", "priority": 0,
+#    "scene": {"environment": {"type": "sky", "strength": 0.3},
+#              "objects": [{"type": "sphere", "center": [0, 0, 3], "radius": 1, "material": {"color": [1, 0, 0]}},
+#                          {"type": "mesh", "file": "objects/teapot.obj", "translation": [0, 0, 5], "axis": [0, 1, 0], "angle": 0.5, "scale": 1}]},
+#    "camera": {"width": 5, "height": 3, "depth": 3, "pixel_scale": 100, "position": [0, 0, 0], "yaw": 0, "pitch": 0,
+#               "rays_per_pixel": 1, "max_reflections": 3, "passes": 1, "gamma": 1, "denoise": false}}
+# rasterize job:
+#   {"kind": "rasterize", "object": {"file": "objects/teapot.obj", "translate": [0, 0, 5], "rotate": [[[1, 0, 0], 3.14]],
+#                                   "wireframe": false, "lod_levels": 0},
+#    "renderer": {"screenx": 6, "screeny": 4, "nearz": 5}, "lighting": [1, 0, 0]}
+# lower priority values run first, "priority" is not part of the cache key
+
+DEFAULT_PORT = 8765
+
+# --- per-process caches, live for the lifetime of a pool worker ---
+
+_meshes = {} # (path, mtime) -> Mesh, its triangle tables and bvh are built once and shared by Instances
+_raster_meshes = {} # (path, mtime, size, lod_levels) -> (vertices, faces, lod levels) as plain lists, polygons built per job
+
+def _file_key(filename:str):
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+def _vector(v) -> LinAlg.Vector3:
+    return LinAlg.Vector3(*v) if isinstance(v, (list, tuple)) else LinAlg.Vector3(v)
+
+def _material(spec) -> Material.Material:
+    if spec is None: return None
+    return Material.Material(
+        _vector(spec.get("color", 1)), _vector(spec.get("emission_color", 0)), spec.get("emission_strength", 0.0)
+    )
+
+def _rotation(spec) -> LinAlg.Matrix3x3:
+    if "axis" not in spec: return None
+    return LinAlg.Matrix3x3.rotation(_vector(spec["axis"]), spec.get("angle", 0))
+
+def _load_mesh(filename:str) -> RaycastableObject.Mesh:
+    key = _file_key(filename)
+    if key not in _meshes: _meshes[key] = RaycastableObject.Mesh.from_obj(filename)
+    return _meshes[key]
+
+def build_scene(spec:dict) -> Raytrace.Scene:
+    scene = Raytrace.Scene()
+    env = spec.get("environment", {"type": "sky"})
+    if env["type"] == "sky": scene.set_environment(Environment.SkyGradient(env.get("strength", 0.3)))
+    elif env["type"] == "image":
+        scene.set_environment(Environment.ImageEnvironment(env["file"], env.get("strength", 1.0), env.get("gamma", 2.2)))
+    for obj in spec.get("objects", []):
+        t, m = obj["type"], _material(obj.get("material"))
+        if t == "sphere": scene.add_object(RaycastableObject.Sphere(_vector(obj["center"]), obj["radius"], m))
+        elif t == "triangle": scene.add_object(RaycastableObject.Triangle(*map(_vector, obj["vertices"]), m))
+        elif t == "parallelogram": scene.add_object(RaycastableObject.Parallelogram(*map(_vector, obj["vertices"]), m))
+        elif t == "box":
+            w, h, d = obj["size"]
+            scene.add_object(RaycastableObject.Box(_vector(obj["center"]), w, h, d, m, _rotation(obj)))
+        elif t == "plane": scene.add_object(RaycastableObject.Plane(_vector(obj["point"]), _vector(obj["normal"]), m))
+        elif t == "disk":
+            scene.add_object(RaycastableObject.Disk(_vector(obj["center"]), _vector(obj["normal"]), obj["radius"], m))
+        elif t == "mesh":
+            transform = LinAlg.Transform(_vector(obj.get("translation", 0)), _rotation(obj), obj.get("scale", 1))
+            scene.add_instance(_load_mesh(obj["file"]), transform, m)
+        else:
+            raise ValueError(f"unknown object type {t}")
+    return scene
+
+def render_raytrace(job:dict, filename:str):
+    c = job["camera"]
+    camera = Raytrace.Camera(build_scene(job["scene"]), c.get("width", 5), c.get("height", 3), c.get("depth", 3))
+    if "pixel_scale" in c:
+        camera.scene_pixel_scale = c["pixel_scale"]
+        camera.width_pixels = int(camera.width * camera.scene_pixel_scale)
+        camera.height_pixels = int(camera.height * camera.scene_pixel_scale)
+    camera.set_parameters(c.get("rays_per_pixel", 1), c.get("max_reflections", 3))
+    camera.set_position(_vector(c.get("position", 0)))
+    camera.set_orientation(c.get("yaw", 0), c.get("pitch", 0))
+    for _ in range(c.get("passes", 1)): camera.render()
+    img = camera.get_img(c.get("gamma", 1), c.get("denoise", False))
+    with open(filename, "wb") as f:
+        f.write(f"P6\n{camera.width_pixels} {camera.height_pixels}\n255\n".encode())
+        for row in img:
+            f.write(bytes(min(max(int(v * 256), 0), 255) for p in row for v in p.to_tuple()))
+
+def render_rasterize(job:dict, filename:str):
+    import Rasterize # top-level module, importable when the service runs from the repository root
+    o, r = job["object"], job.get("renderer", {})
+    lod_levels = 0 if o.get("wireframe", False) else o.get("lod_levels", 0)
+    key = _file_key(o["file"]) + (lod_levels,)
+    if key not in _raster_meshes:
+        vertices, faces = Rasterize.read_obj(o["file"])
+        levels = Rasterize.load_lods(o["file"], vertices, faces, lod_levels) if lod_levels > 0 else []
+        _raster_meshes[key] = (vertices, faces, levels)
+    vertices, faces, levels = _raster_meshes[key] # jobs transform their own fresh polygons, never the cached lists
+    if o.get("wireframe", False): obj = Rasterize.WavefrontObjOutline.from_mesh(vertices, faces)
+    else: obj = Rasterize.WavefrontObj.from_mesh(vertices, faces, levels)
+    obj.translate(*o.get("translate", (0, 0, 0)))
+    for axis, angle in o.get("rotate", []): obj.rotate(obj.center, Rasterize.Point3D(*axis), angle)
+    renderer = Rasterize.Renderer(r.get("screenx", 6), r.get("screeny", 4), r.get("nearz", 5))
+    lighting = Rasterize.Point3D(*job.get("lighting", (1, 0, 0)))
+    img = renderer.render_object_rasterize(obj, lighting)
+    with open(filename, "wb") as f:
+        f.write(f"P5\n{len(img[0])} {len(img)}\n255\n".encode())
+        for row in img: f.write(bytes(min(max(int(v), 0), 255) for v in row))
+
+def run_job(job:dict, filename:str) -> str: # runs in a pool worker, writes to a temporary name then renames
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    if job["kind"] == "raytrace": render_raytrace(job, tmp)
+    elif job["kind"] == "rasterize": render_rasterize(job, tmp)
+    else: raise ValueError(f"unknown job kind {job['kind']}")
+    os.replace(tmp, filename)
+    return filename
+
+def job_files(job:dict) -> typing.List[str]: # every file a job reads, their mtimes are part of the cache key
+    if job.get("kind") not in ("raytrace", "rasterize"): raise ValueError(f"unknown job kind {job.get('kind')}")
+    if job["kind"] == "rasterize": return [job["object"]["file"]]
+    files = [obj["file"] for obj in job["scene"].get("objects", []) if "file" in obj]
+    env = job["scene"].get("environment", {})
+    if "file" in env: files.append(env["file"])
+    return files
+
+def job_key(job:dict) -> str:
+    spec = {k: v for k, v in job.items() if k != "priority"}
+    files = [list(_file_key(f)) for f in job_files(job)]
+    data = json.dumps([spec, files], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+class ResultCache: # result files named by job key, least recently used evicted above max_bytes
+    def __init__(self, directory:str, max_bytes:int=512 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key:str, kind:str) -> str:
+        return os.path.join(self.directory, key + (".pgm" if kind == "rasterize" else ".ppm"))
+
+    def get(self, key:str, kind:str) -> str:
+        path = self.path(key, kind)
+        if not os.path.exists(path): return None
+        os.utime(path) # mtime doubles as the lru timestamp
+        return path
+
+    def evict(self, keep:str=None): # keep: path of a result about to be handed out, never removed even if oversized
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp") or (keep is not None and name == os.path.basename(keep)): continue
+            st = os.stat(os.path.join(self.directory, name))
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep is not None else 0)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes: break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+class JobService:
+    def __init__(self, cache_dir:str=".render_cache", max_cache_bytes:int=512 << 20, workers:int=None):
+        self.cache = ResultCache(cache_dir, max_cache_bytes)
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.stats = {"submitted": 0, "cached": 0, "deduplicated": 0, "rendered": 0, "failed": 0}
+        self._inflight = {} # key -> future shared by identical jobs submitted while the first is running
+        self._order = itertools.count() # fifo among equal priorities
+        self._queue = None
+
+    async def submit(self, job:dict) -> dict:
+        self.stats["submitted"] += 1
+        key = job_key(job)
+        path = self.cache.get(key, job["kind"])
+        if path is not None:
+            self.stats["cached"] += 1
+            return {"status": "done", "key": key, "path": path, "cached": True}
+        if key in self._inflight:
+            self.stats["deduplicated"] += 1
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        await self._queue.put((job.get("priority", 0), next(self._order), key, job))
+        return await asyncio.shield(future)
+
+    async def _dispatch(self): # one per pool worker, so the queue and not the pool decides the order
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, key, job = await self._queue.get()
+            future = self._inflight[key]
+            try:
+                path = await loop.run_in_executor(self.pool, run_job, job, self.cache.path(key, job["kind"]))
+                self.cache.evict(keep=path)
+                self.stats["rendered"] += 1
+                future.set_result({"status": "done", "key": key, "path": path, "cached": False})
+            except Exception as e:
+                self.stats["failed"] += 1
+                future.set_result({"status": "error", "key": key, "error": f"{type(e).__name__}: {e}"})
+            finally:
+                del self._inflight[key]
+
+    async def _handle_request(self, request:dict) -> dict:
+        op = request.get("op", "render")
+        if op == "render":
+            try:
+                result = await self.submit(request["job"])
+            except (KeyError, TypeError, ValueError, OSError) as e: # malformed job or missing file
+                result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        elif op == "stats": result = {"status": "done", "stats": dict(self.stats)}
+        else: result = {"status": "error", "error": f"unknown op {op}"}
+        if "id" in request: result["id"] = request["id"]
+        return result
+
+    async def _handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        # requests on one connection run concurrently, replies carry the request id
+        lock = asyncio.Lock()
+        async def respond(line:bytes):
+            try:
+                result = await self._handle_request(json.loads(line))
+            except json.JSONDecodeError as e:
+                result = {"status": "error", "error": f"invalid json: {e}"}
+            async with lock:
+                writer.write(json.dumps(result).encode() + b"\n")
+                await writer.drain()
+        tasks = []
+        try:
+            while line := await reader.readline():
+                if line.strip(): tasks.append(asyncio.create_task(respond(line)))
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host:str="127.0.0.1", port:int=DEFAULT_PORT):
+        self._queue = asyncio.PriorityQueue()
+        dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self._handle_client, host, port, limit=1 << 24)
+        print(f"render job service on {host}:{server.sockets[0].getsockname()[1]}, cache {self.cache.directory}")
+        try:
+            async with server: await server.serve_forever()
+        finally:
+            for task in dispatchers: task.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+def submit(job:dict, host:str="127.0.0.1", port:int=DEFAULT_PORT, timeout:float=None) -> dict:
+    # blocking client, one job per connection
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps({"op": "render", "job": job}).encode() + b"\n")
+        with sock.makefile("rb") as f: return json.loads(f.readline())
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="local render job service")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache", default=".render_cache")
+    parser.add_argument("--cache-mb", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    service = JobService(args.cache, args.cache_mb << 20, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -84,8 +84,34 @@ class Matrix3x3:
     def __mul__(self, v:Vector3) -> Vector3:
         return Vector3(
             self.arr[0] * v.x + self.arr[1] * v.y + self.arr[2] * v.z,
-            self.arr[4] * v.x + self.arr[5] * v.y + self.arr[6] * v.z,
-            self.arr[7] * v.x + self.arr[8] * v.y + self.arr[9] * v.z
+            self.arr[3] * v.x + self.arr[4] * v.y + self.arr[5] * v.z,
+            self.arr[6] * v.x + self.arr[7] * v.y + self.arr[8] * v.z
+        )
+
+    def __matmul__(self, m:Matrix3x3) -> Matrix3x3:
+        a, b = self.arr, m.arr
+        return Matrix3x3(*(
+            Vector3(*(a[3*i] * b[j] + a[3*i + 1] * b[3 + j] + a[3*i + 2] * b[6 + j] for j in range(3)))
+            for i in range(3)
+        ))
+
+    def transpose(self) -> Matrix3x3:
+        a = self.arr
+        return Matrix3x3(Vector3(a[0], a[3], a[6]), Vector3(a[1], a[4], a[7]), Vector3(a[2], a[5], a[8]))
+
+    @staticmethod
+    def identity() -> Matrix3x3:
+        return Matrix3x3(Vector3(1, 0, 0), Vector3(0, 1, 0), Vector3(0, 0, 1))
+
+    @staticmethod
+    def rotation(axis:Vector3, angle:float) -> Matrix3x3: # rodrigues' rotation formula
+        x, y, z = axis.norm().to_tuple()
+        c, s = math.cos(angle), math.sin(angle)
+        C = 1 - c
+        return Matrix3x3(
+            Vector3(c + x*x*C, x*y*C - z*s, x*z*C + y*s),
+            Vector3(y*x*C + z*s, c + y*y*C, y*z*C - x*s),
+            Vector3(z*x*C - y*s, z*y*C + x*s, c + z*z*C)
         )
     
     def determinant(self) -> float:
@@ -95,4 +121,30 @@ class Matrix3x3:
             self.arr[5] * self.arr[6] - self.arr[3] * self.arr[8]
         ) + self.arr[2] * (
             self.arr[3] * self.arr[7] - self.arr[4] * self.arr[6]
-        )
\ No newline at end of file
+        )
+
+class Transform: # uniform scale, then rotation, then translation
+    def __init__(self, translation:Vector3=None, rotation:Matrix3x3=None, scale:float=1):
+        self.translation = Vector3(0) if translation is None else translation
+        self.rotation = Matrix3x3.identity() if rotation is None else rotation
+        self.scale = scale
+        self._inverse_rotation = self.rotation.transpose() # rotations are orthonormal
+
+    def apply_point(self, p:Vector3) -> Vector3:
+        return self.rotation * (p * self.scale) + self.translation
+
+    def apply_vector(self, v:Vector3) -> Vector3: # directions and normals, not scaled
+        return self.rotation * v
+
+    def inverse_point(self, p:Vector3) -> Vector3:
+        return self._inverse_rotation * (p - self.translation) / self.scale
+
+    def inverse_vector(self, v:Vector3) -> Vector3:
+        return self._inverse_rotation * v
+
+    def __matmul__(self, t:Transform) -> Transform: # self applied after t
+        return Transform(
+            self.apply_point(t.translation),
+            self.rotation @ t.rotation,
+            self.scale * t.scale
+        )
@@ -0,0 +1,306 @@
+import abc, array, math, typing
+from . import BVH, LinAlg, Material, Ray, RaycastableObject
+
+# packed structure-of-arrays storage for the plain primitives of a scene or group
+# each table keeps its own flattened bvh whose leaves are contiguous index ranges into the arrays
+
+class PrimitiveTable(abc.ABC):
+    leaf_size = 4
+
+    def __init__(self, objects:list, materials:"MaterialTable"):
+        self.objects = [] # source object per slot, reported as hit_object
+        self.materials = materials # shared with the other tables, material_index points into it
+        self.material_index = array.array("i")
+        self.epsilon = array.array("d")
+        self._pack(objects)
+        self._build()
+
+    def __len__(self):
+        return len(self.objects)
+
+    @abc.abstractmethod
+    def _pack(self, objects:list):
+        pass
+
+    @abc.abstractmethod
+    def repack(self, i:int): # reload slot i from its object after it changed in place
+        pass
+
+    @abc.abstractmethod
+    def _slot_bounds(self, i:int) -> typing.Tuple[float, float, float, float, float, float]:
+        pass
+
+    @abc.abstractmethod
+    def _permute(self, order:typing.List[int]):
+        pass
+
+    @abc.abstractmethod
+    def _intersect(self, ox, oy, oz, dx, dy, dz, start:int, end:int, best_t:float) -> typing.Tuple[float, int]:
+        pass
+
+    @abc.abstractmethod
+    def _hitinfo(self, ray:Ray.Ray, t:float, i:int) -> RaycastableObject.RayHitInfo:
+        pass
+
+    def _material(self, i:int) -> Material.Material:
+        return self.materials.materials[self.material_index[i]]
+
+    def _build(self):
+        n = len(self.objects)
+        self.node_box = array.array("d") # 6 floats per node
+        self.node_start = array.array("i") # leaves: first slot; inner nodes: right child, left child is next
+        self.node_count = array.array("i") # leaves: slot count; inner nodes: 0
+        if n == 0: return
+        boxes = [self._slot_bounds(i) for i in range(n)]
+        order = []
+        self._build_node(list(range(n)), boxes, order)
+        self._permute(order)
+
+    def _build_node(self, slots:typing.List[int], boxes, order:typing.List[int]):
+        node = len(self.node_count)
+        lo = [min(boxes[i][k] for i in slots) for k in range(3)]
+        hi = [max(boxes[i][k + 3] for i in slots) for k in range(3)]
+        self.node_box.extend(lo + hi)
+        if len(slots) <= self.leaf_size:
+            self.node_start.append(len(order))
+            self.node_count.append(len(slots))
+            order.extend(slots)
+            return
+        self.node_start.append(0)
+        self.node_count.append(0)
+        axis = max(range(3), key=lambda k: max(boxes[i][k] + boxes[i][k + 3] for i in slots) - min(boxes[i][k] + boxes[i][k + 3] for i in slots))
+        slots.sort(key=lambda i: boxes[i][axis] + boxes[i][axis + 3]) # median split on widest centroid axis
+        mid = len(slots) // 2
+        self._build_node(slots[:mid], boxes, order)
+        self.node_start[node] = len(self.node_count)
+        self._build_node(slots[mid:], boxes, order)
+
+    def refit(self): # after slots were repacked in place
+        for node in range(len(self.node_count) - 1, -1, -1): # children always follow their parent
+            if self.node_count[node]:
+                start = self.node_start[node]
+                box = [self._slot_bounds(i) for i in range(start, start + self.node_count[node])]
+            else:
+                right = self.node_start[node]
+                box = [self.node_box[6*c:6*c + 6] for c in (node + 1, right)]
+            self.node_box[6*node:6*node + 6] = array.array("d",
+                [min(b[k] for b in box) for k in range(3)] + [max(b[k + 3] for b in box) for k in range(3)]
+            )
+
+    def hit(self, ray:Ray.Ray, closest:RaycastableObject.RayHitInfo) -> RaycastableObject.RayHitInfo:
+        if not self.objects: return closest
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        dx, dy, dz = ray.direction.x, ray.direction.y, ray.direction.z
+        ix = 1 / dx if dx != 0 else 1e30
+        iy = 1 / dy if dy != 0 else 1e30
+        iz = 1 / dz if dz != 0 else 1e30
+        box, start, count = self.node_box, self.node_start, self.node_count
+        best_t, best_i = closest.t, -1
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            b = 6 * node
+            t0, t1 = (box[b] - ox) * ix, (box[b + 3] - ox) * ix
+            if t0 > t1: t0, t1 = t1, t0
+            s0, s1 = (box[b + 1] - oy) * iy, (box[b + 4] - oy) * iy
+            if s0 > s1: s0, s1 = s1, s0
+            if s0 > t0: t0 = s0
+            if s1 < t1: t1 = s1
+            s0, s1 = (box[b + 2] - oz) * iz, (box[b + 5] - oz) * iz
+            if s0 > s1: s0, s1 = s1, s0
+            if s0 > t0: t0 = s0
+            if s1 < t1: t1 = s1
+            if t1 < 0 or t0 > t1 or t0 > best_t: continue
+            c = count[node]
+            if c:
+                t, i = self._intersect(ox, oy, oz, dx, dy, dz, start[node], start[node] + c, best_t)
+                if i >= 0: best_t, best_i = t, i
+            else:
+                stack.append(start[node])
+                stack.append(node + 1)
+        if best_i < 0: return closest
+        return self._hitinfo(ray, best_t, best_i)
+
+class SphereTable(PrimitiveTable):
+    def _pack(self, objects:list):
+        self.cx, self.cy, self.cz, self.radius = (array.array("d") for _ in range(4))
+        for obj in objects:
+            self.objects.append(obj)
+            self.cx.append(obj.center.x); self.cy.append(obj.center.y); self.cz.append(obj.center.z)
+            self.radius.append(obj.radius)
+            self.epsilon.append(obj.epsilon)
+            self.material_index.append(self.materials.index(obj.material))
+
+    def repack(self, i:int):
+        obj = self.objects[i]
+        self.cx[i], self.cy[i], self.cz[i] = obj.center.x, obj.center.y, obj.center.z
+        self.radius[i] = obj.radius
+        self.material_index[i] = self.materials.index(obj.material)
+
+    def _slot_bounds(self, i:int):
+        r = self.radius[i]
+        return (self.cx[i] - r, self.cy[i] - r, self.cz[i] - r, self.cx[i] + r, self.cy[i] + r, self.cz[i] + r)
+
+    def _permute(self, order:typing.List[int]):
+        for name in ("cx", "cy", "cz", "radius", "epsilon", "material_index"):
+            a = getattr(self, name)
+            setattr(self, name, array.array(a.typecode, [a[i] for i in order]))
+        self.objects = [self.objects[i] for i in order]
+
+    def _intersect(self, ox, oy, oz, dx, dy, dz, start, end, best_t):
+        cx, cy, cz, radius, epsilon = self.cx, self.cy, self.cz, self.radius, self.epsilon
+        a = dx*dx + dy*dy + dz*dz
+        best_i = -1
+        for i in range(start, end):
+            lx, ly, lz = ox - cx[i], oy - cy[i], oz - cz[i]
+            b = 2 * (lx*dx + ly*dy + lz*dz)
+            c = lx*lx + ly*ly + lz*lz - radius[i]*radius[i]
+            delta = b*b - 4*a*c
+            if delta < 0: continue
+            sq = math.sqrt(delta)
+            t = (-b - sq) / (2 * a)
+            if not t > 0: t = (-b + sq) / (2 * a)
+            if t < 0 or t >= best_t: continue
+            te = t - epsilon[i] # elevated hit point must face the ray
+            if (lx + dx*te)*dx + (ly + dy*te)*dy + (lz + dz*te)*dz > 0: continue
+            best_t, best_i = t, i
+        return best_t, best_i
+
+    def _hitinfo(self, ray:Ray.Ray, t:float, i:int) -> RaycastableObject.RayHitInfo:
+        hit_point = ray.eval(t - self.epsilon[i])
+        normal = (hit_point - LinAlg.Vector3(self.cx[i], self.cy[i], self.cz[i])).norm()
+        return RaycastableObject.RayHitInfo(t, hit_point, normal, self.objects[i], self._material(i))
+
+class TriangleTable(PrimitiveTable):
+    def _pack(self, objects:list):
+        names = ("x0", "y0", "z0", "e1x", "e1y", "e1z", "e2x", "e2y", "e2z", "nx", "ny", "nz")
+        for name in names: setattr(self, name, array.array("d"))
+        for obj in objects:
+            self.objects.append(obj)
+            for name in names: getattr(self, name).append(0)
+            self.epsilon.append(obj.epsilon)
+            self.material_index.append(0)
+            self.repack(len(self.objects) - 1)
+
+    def repack(self, i:int):
+        obj = self.objects[i]
+        self.material_index[i] = self.materials.index(obj.material)
+        self.x0[i], self.y0[i], self.z0[i] = obj.v0.to_tuple()
+        self.e1x[i], self.e1y[i], self.e1z[i] = obj.edge1.to_tuple()
+        self.e2x[i], self.e2y[i], self.e2z[i] = obj.edge2.to_tuple()
+        self.nx[i], self.ny[i], self.nz[i] = obj.normal.to_tuple()
+
+    def _slot_bounds(self, i:int):
+        x, y, z = self.x0[i], self.y0[i], self.z0[i]
+        xs = (x, x + self.e1x[i], x + self.e2x[i])
+        ys = (y, y + self.e1y[i], y + self.e2y[i])
+        zs = (z, z + self.e1z[i], z + self.e2z[i])
+        e = self.epsilon[i]
+        return (min(xs) - e, min(ys) - e, min(zs) - e, max(xs) + e, max(ys) + e, max(zs) + e)
+
+    def _permute(self, order:typing.List[int]):
+        for name in ("x0", "y0", "z0", "e1x", "e1y", "e1z", "e2x", "e2y", "e2z", "nx", "ny", "nz", "epsilon", "material_index"):
+            a = getattr(self, name)
+            setattr(self, name, array.array(a.typecode, [a[i] for i in order]))
+        self.objects = [self.objects[i] for i in order]
+
+    def _intersect(self, ox, oy, oz, dx, dy, dz, start, end, best_t):
+        x0, y0, z0 = self.x0, self.y0, self.z0
+        e1x, e1y, e1z, e2x, e2y, e2z = self.e1x, self.e1y, self.e1z, self.e2x, self.e2y, self.e2z
+        nx, ny, nz, epsilon = self.nx, self.ny, self.nz, self.epsilon
+        best_i = -1
+        for i in range(start, end):
+            if dx*nx[i] + dy*ny[i] + dz*nz[i] >= -epsilon[i]: continue # one sided, like Triangle.hit
+            ax, ay, az = e1x[i], e1y[i], e1z[i]
+            bx, by, bz = e2x[i], e2y[i], e2z[i]
+            px, py, pz = dy*bz - dz*by, dz*bx - dx*bz, dx*by - dy*bx # moller-trumbore
+            det = ax*px + ay*py + az*pz
+            if det == 0: continue
+            inv = 1 / det
+            tx, ty, tz = ox - x0[i], oy - y0[i], oz - z0[i]
+            c1 = (tx*px + ty*py + tz*pz) * inv
+            if c1 < 0 or c1 > 1: continue
+            qx, qy, qz = ty*az - tz*ay, tz*ax - tx*az, tx*ay - ty*ax
+            c2 = (dx*qx + dy*qy + dz*qz) * inv
+            if c2 < 0 or c1 + c2 > 1: continue
+            t = (bx*qx + by*qy + bz*qz) * inv
+            if t < 0 or t >= best_t: continue
+            best_t, best_i = t, i
+        return best_t, best_i
+
+    def _hitinfo(self, ray:Ray.Ray, t:float, i:int) -> RaycastableObject.RayHitInfo:
+        obj = self.objects[i]
+        return RaycastableObject.RayHitInfo(t, ray.eval(t - self.epsilon[i]), obj.normal, obj, self._material(i))
+
+class MaterialTable:
+    def __init__(self):
+        self.materials:typing.List[Material.Material] = []
+        self._index = {}
+
+    def index(self, material:Material.Material) -> int:
+        key = id(material)
+        if key not in self._index:
+            self._index[key] = len(self.materials)
+            self.materials.append(material)
+        return self._index[key]
+
+class CompiledPrimitives: # spheres and triangles packed into tables, every other object kept in a bvh
+    def __init__(self, objects:list):
+        spheres, triangles, others = [], [], []
+        for obj in objects:
+            kind = type(obj)
+            if kind is RaycastableObject.Sphere: spheres.append(obj)
+            elif kind is RaycastableObject.Triangle: triangles.append(obj)
+            elif kind is RaycastableObject.Parallelogram: triangles += [obj.triangle1, obj.triangle2]
+            else: others.append(obj)
+        self.materials = MaterialTable()
+        self.spheres = SphereTable(spheres, self.materials)
+        self.triangles = TriangleTable(triangles, self.materials)
+        self.bvh = BVH.BVH(others)
+        self._slot = {} # id(source object) -> (table, slot)
+        for table in (self.spheres, self.triangles):
+            for i, obj in enumerate(table.objects): self._slot[id(obj)] = (table, i)
+        for obj in objects:
+            if type(obj) is RaycastableObject.Parallelogram:
+                self._slot[id(obj)] = [self._slot[id(obj.triangle1)], self._slot[id(obj.triangle2)]]
+        self._groups = {} # id(group) -> (group, the objects in this set placing it), moves inside are passed down
+        for obj in others:
+            group = obj.object if isinstance(obj, RaycastableObject.Instance) else obj
+            if isinstance(group, RaycastableObject.Group): self._groups.setdefault(id(group), (group, []))[1].append(obj)
+
+    def refit(self, objects:list) -> list: # objects changed in place since compilation, returns the ones not found
+        dirty_tables, others, missing = set(), [], []
+        for obj in objects:
+            slots = self._slot.get(id(obj))
+            if slots is None:
+                (others if self.bvh.contains(obj) else missing).append(obj)
+                continue
+            for table, i in (slots if isinstance(slots, list) else [slots]):
+                table.repack(i)
+                dirty_tables.add(table)
+        for group, users in self._groups.values(): # shared groups are refit once, however many instances use them
+            if not missing: break
+            left = group.refit(missing)
+            if len(left) == len(missing): continue
+            for user in users:
+                if user is not group: user.geometry_moved()
+                others.append(user)
+            missing = left
+        for table in dirty_tables: table.refit()
+        if others: self.bvh.refit(others)
+        return missing
+
+    def bounds(self) -> BVH.AABB:
+        boxes = [table.node_box[0:6] for table in (self.spheres, self.triangles) if len(table)]
+        if self.bvh.unbounded: return None
+        if self.bvh.root is not None: boxes.append(self.bvh.root.box)
+        if not boxes: return None
+        return BVH.AABB(
+            LinAlg.Vector3(*(min(b[k] for b in boxes) for k in range(3))),
+            LinAlg.Vector3(*(max(b[k + 3] for b in boxes) for k in range(3)))
+        )
+
+    def hit(self, ray:Ray.Ray) -> RaycastableObject.RayHitInfo:
+        closest = self.triangles.hit(ray, RaycastableObject.RayHitInfo.empty())
+        closest = self.spheres.hit(ray, closest)
+        return self.bvh.hit(ray, closest)
@@ -1,16 +1,19 @@
-import abc, math
-from . import LinAlg, Material, Ray
+import abc, math, typing
+from . import BVH, LinAlg, Material, Ray
 
 class RayHitInfo:
     def __init__(self, t : float,
         hit_point : LinAlg.Vector3,
         hit_normal : LinAlg.Vector3,
-        hit_object : "RaycastableObject"
+        hit_object : "RaycastableObject",
+        hit_material : Material.Material = None
     ):
         self.t = t
         self.hit_point = hit_point
         self.hit_normal = hit_normal
         self.hit_object = hit_object
+        # shading material, packed primitive tables and instances report it directly
+        self.hit_material = hit_object.material if hit_material is None and hit_object is not None else hit_material
 
     def __bool__(self):
         return self.t < math.inf
@@ -33,6 +36,9 @@ class RaycastableObject(abc.ABC):
     def hit(self, ray:Ray.Ray) -> RayHitInfo:
         pass
 
+    def bounds(self) -> BVH.AABB: # None for unbounded objects
+        return None
+
     def set_material(self, material:Material.Material):
         self.material = material
 
@@ -66,6 +72,10 @@ class Sphere(RaycastableObject):
             return RayHitInfo.empty() # ray is hitting surface from behind
         return RayHitInfo(t, hit_point, hit_surface_norm, self)
 
+    def bounds(self) -> BVH.AABB:
+        r = LinAlg.Vector3(self.radius)
+        return BVH.AABB(self.center - r, self.center + r)
+
 class Triangle(RaycastableObject):
     def __init__(self, v0:LinAlg.Vector3, v1:LinAlg.Vector3, v2:LinAlg.Vector3, material:Material.Material=None):
         super().__init__(material)
@@ -99,8 +109,13 @@ class Triangle(RaycastableObject):
         t = LinAlg.Matrix3x3(
             ray.origin - self.v0, self.edge1, self.edge2
         ).determinant() / det
+        if t < 0:
+            return RayHitInfo.empty() # hit point is behind the ray
         hit_point = ray.eval(t - self.epsilon)
         return RayHitInfo(t, hit_point, self.normal, self)
+
+    def bounds(self) -> BVH.AABB:
+        return BVH.AABB.from_points([self.v0, self.v1, self.v2], self.epsilon)
     
 class Parallelogram(RaycastableObject): # formed by two mirrored Triangles
     def __init__(self, v0:LinAlg.Vector3, v1:LinAlg.Vector3, v2:LinAlg.Vector3, material:Material.Material=None):
@@ -119,13 +134,155 @@ class Parallelogram(RaycastableObject): # formed by two mirrored Triangles
         if hit_info2 := self.triangle2.hit(ray): return hit_info2
         return RayHitInfo.empty()
 
-class Box(RaycastableObject):
-    def __init__(self, center:LinAlg.Vector3, width:float, height:float, depth:float):
-        super().__init__()
+    def bounds(self) -> BVH.AABB:
+        return BVH.AABB.from_points([self.v0, self.v1, self.v2, self.v3], self.epsilon)
+
+class Box(RaycastableObject): # slab test in the box frame, optionally rotated
+    def __init__(self, center:LinAlg.Vector3, width:float, height:float, depth:float,
+        material:Material.Material=None, rotation:LinAlg.Matrix3x3=None
+    ):
+        super().__init__(material)
         self.center = center
         self.width = width
         self.height = height
         self.depth = depth
-    
+        self.rotation = rotation
+        self._inverse_rotation = None if rotation is None else rotation.transpose()
+        self.half = (width / 2, height / 2, depth / 2)
+
     def hit(self, ray:Ray.Ray) -> RayHitInfo:
-        pass
\ No newline at end of file
+        O, D = ray.origin - self.center, ray.direction
+        if self._inverse_rotation is not None:
+            O, D = self._inverse_rotation * O, self._inverse_rotation * D
+        o, d = O.to_tuple(), D.to_tuple()
+        tmin, tmax, axis = -math.inf, math.inf, 0
+        for k in range(3):
+            if d[k] == 0:
+                if abs(o[k]) > self.half[k]: return RayHitInfo.empty() # parallel and outside the slab
+                continue
+            t0 = (-self.half[k] - o[k]) / d[k]
+            t1 = (self.half[k] - o[k]) / d[k]
+            if t0 > t1: t0, t1 = t1, t0
+            if t0 > tmin: tmin, axis = t0, k
+            if t1 < tmax: tmax = t1
+            if tmin > tmax: return RayHitInfo.empty()
+        if tmin < 0:
+            return RayHitInfo.empty() # box is behind the ray, or the ray starts inside it
+        n = [0, 0, 0]
+        n[axis] = -1 if d[axis] > 0 else 1
+        normal = LinAlg.Vector3(*n)
+        if self.rotation is not None: normal = self.rotation * normal
+        return RayHitInfo(tmin, ray.eval(tmin - self.epsilon), normal, self)
+
+    def bounds(self) -> BVH.AABB:
+        hx, hy, hz = self.half
+        corners = [LinAlg.Vector3(x, y, z) for x in (-hx, hx) for y in (-hy, hy) for z in (-hz, hz)]
+        if self.rotation is not None: corners = [self.rotation * c for c in corners]
+        return BVH.AABB.from_points([self.center + c for c in corners], self.epsilon)
+
+class Plane(RaycastableObject): # infinite plane, hit from either side
+    def __init__(self, point:LinAlg.Vector3, normal:LinAlg.Vector3, material:Material.Material=None):
+        super().__init__(material)
+        self.point = point
+        self.normal = normal.norm()
+        self._offset = self.normal.dot(point)
+
+    def _intersect(self, ray:Ray.Ray) -> float:
+        den = self.normal.dot(ray.direction)
+        if den == 0: return math.inf
+        t = (self._offset - self.normal.dot(ray.origin)) / den
+        return t if t > 0 else math.inf
+
+    def hit(self, ray:Ray.Ray) -> RayHitInfo:
+        t = self._intersect(ray)
+        if t == math.inf: return RayHitInfo.empty()
+        normal = self.normal if self.normal.dot(ray.direction) < 0 else self.normal * -1
+        return RayHitInfo(t, ray.eval(t - self.epsilon), normal, self)
+
+class Disk(Plane):
+    def __init__(self, center:LinAlg.Vector3, normal:LinAlg.Vector3, radius:float, material:Material.Material=None):
+        super().__init__(center, normal, material)
+        self.center = center
+        self.radius = radius
+
+    def hit(self, ray:Ray.Ray) -> RayHitInfo:
+        t = self._intersect(ray)
+        if t == math.inf: return RayHitInfo.empty()
+        p = ray.eval(t) - self.center
+        if p.dot(p) > self.radius * self.radius: return RayHitInfo.empty()
+        normal = self.normal if self.normal.dot(ray.direction) < 0 else self.normal * -1
+        return RayHitInfo(t, ray.eval(t - self.epsilon), normal, self)
+
+    def bounds(self) -> BVH.AABB:
+        n = self.normal
+        e = LinAlg.Vector3(*(self.radius * math.sqrt(max(1 - c*c, 0)) + self.epsilon for c in n.to_tuple()))
+        return BVH.AABB(self.center - e, self.center + e)
+
+class Group(RaycastableObject): # objects sharing one acceleration structure, the geometry of an Instance
+    def __init__(self, objects:typing.List[RaycastableObject], material:Material.Material=None):
+        from . import Primitives # imports this module
+        super().__init__(material)
+        self.objects = objects
+        self.primitives = Primitives.CompiledPrimitives(objects)
+        self._bounds = self.primitives.bounds()
+
+    def hit(self, ray:Ray.Ray) -> RayHitInfo:
+        return self.primitives.hit(ray)
+
+    def refit(self, objects:list) -> list: # objects of the group changed in place, returns the ones it does not hold
+        left = self.primitives.refit(objects)
+        if len(left) < len(objects): self._bounds = self.primitives.bounds()
+        return left
+
+    def bounds(self) -> BVH.AABB:
+        return self._bounds
+
+class Mesh(Group): # triangle mesh loaded from a wavefront .obj file
+    @staticmethod
+    def from_obj(filename:str, material:Material.Material=None) -> "Mesh":
+        with open(filename, "r") as f: lines = f.read().split("\n")
+        points, triangles = [], []
+        for line in lines:
+            l = line.split()
+            if len(l) == 0: continue
+            if l[0] == "v": points.append(LinAlg.Vector3(float(l[1]), float(l[2]), float(l[3])))
+            elif l[0] == "f":
+                index = [int(v.split("/")[0]) - 1 for v in l[1:]]
+                for i in range(1, len(index) - 1): # fan triangulation
+                    v0, v1, v2 = points[index[0]], points[index[i]], points[index[i + 1]]
+                    if (v1 - v0).cross(v2 - v0).length() == 0: continue # degenerate
+                    triangles.append(Triangle(v0, v1, v2, material))
+        return Mesh(triangles, material)
+
+class Instance(RaycastableObject): # places shared geometry in the scene with its own transform
+    def __init__(self, obj:RaycastableObject, transform:LinAlg.Transform=None, material:Material.Material=None):
+        super().__init__(material)
+        self.object = obj
+        self.override_material = material is not None # otherwise hits report the shared geometry's material
+        self.set_transform(LinAlg.Transform() if transform is None else transform)
+
+    def set_transform(self, transform:LinAlg.Transform):
+        self.transform = transform
+        self._bounds = None
+
+    def geometry_moved(self): # the shared object changed in place, world bounds are recomputed on demand
+        self._bounds = None
+
+    def hit(self, ray:Ray.Ray) -> RayHitInfo:
+        T = self.transform
+        hitinfo = self.object.hit(Ray.Ray(T.inverse_point(ray.origin), T.inverse_vector(ray.direction)))
+        if not hitinfo: return hitinfo
+        return RayHitInfo(
+            hitinfo.t * T.scale,
+            T.apply_point(hitinfo.hit_point),
+            T.apply_vector(hitinfo.hit_normal),
+            self if self.override_material else hitinfo.hit_object,
+            self.material if self.override_material else hitinfo.hit_material
+        )
+
+    def bounds(self) -> BVH.AABB:
+        if self._bounds is None:
+            local = self.object.bounds()
+            if local is None: return None
+            self._bounds = BVH.AABB.from_points([self.transform.apply_point(p) for p in local.corners()])
+        return self._bounds
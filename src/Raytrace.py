@@ -1,18 +1,64 @@
-import math, random, time, typing
-from . import LinAlg, Ray, RaycastableObject
+import math, mmap, random, time, typing
+from . import Denoise, Environment, LinAlg, Material, Primitives, Ray, RaycastableObject
 
 class Scene:
     def __init__(self):
         self.objects:typing.List[RaycastableObject.RaycastableObject] = []
+        self.environment:Environment.Environment = Environment.SkyGradient()
+        self.primitives:Primitives.CompiledPrimitives = None # packed tables and bvh, built by update()
+        self._rebuild = True # objects were added or removed
+        self._moved = [] # objects whose bounds changed since the last update
     
     def get_background(self, D:LinAlg.Vector3) -> LinAlg.Vector3:
-        ratio = D.y / math.sqrt(D.x**2 + D.z**2)
-        if ratio > 10: return LinAlg.Vector3(0)
-        c = 1 / (1 + math.exp(ratio)) * 0.3
-        return LinAlg.Vector3(c)
+        return self.environment.get(D)
+
+    def set_environment(self, environment:Environment.Environment):
+        self.environment = environment
     
-    def add_object(self, obj:RaycastableObject.RaycastableObject):
+    def add_object(self, obj:RaycastableObject.RaycastableObject) -> RaycastableObject.RaycastableObject:
         self.objects.append(obj)
+        self._rebuild = True
+        return obj
+
+    def remove_object(self, obj:RaycastableObject.RaycastableObject):
+        self.objects.remove(obj)
+        self._rebuild = True
+
+    def add_instance(self, obj:RaycastableObject.RaycastableObject, transform:LinAlg.Transform=None,
+        material:Material.Material=None
+    ) -> RaycastableObject.Instance: # obj is shared, not copied
+        return self.add_object(RaycastableObject.Instance(obj, transform, material))
+
+    def set_transform(self, instance:RaycastableObject.Instance, transform:LinAlg.Transform):
+        instance.set_transform(transform)
+        self.mark_moved(instance)
+
+    def mark_moved(self, obj:RaycastableObject.RaycastableObject): # call after changing an object in place
+        # obj may also sit inside a Group, e.g. the shared geometry of instances, every instance then moves with it
+        self._moved.append(obj)
+
+    def update(self): # recompile if the object set changed, otherwise refit moved objects
+        moved, self._moved = self._moved, []
+        if self._rebuild or self.primitives is None:
+            self.primitives = Primitives.CompiledPrimitives(self.objects)
+            # groups are not recompiled with the scene, objects moved inside them still need a refit;
+            # anything not found was removed since it was marked
+            if moved: self.primitives.refit(moved)
+        elif moved:
+            missing = self.primitives.refit(moved)
+            if missing: raise ValueError(f"{len(missing)} objects marked as moved are not in the scene")
+        self._rebuild = False
+
+    def __getstate__(self): # compiled tables are rebuilt on the receiving side, e.g. by distributed workers
+        state = self.__dict__.copy()
+        state["primitives"] = None
+        state["_rebuild"] = True
+        state["_moved"] = []
+        return state
+
+    def hit(self, ray:Ray.Ray) -> RaycastableObject.RayHitInfo:
+        if self._rebuild or self._moved: self.update()
+        return self.primitives.hit(ray)
 
 class Camera:
     def __init__(self, scene:Scene, width:float, height:float, depth:float):
@@ -26,44 +72,125 @@ class Camera:
 
         self.width_pixels = int(self.width * self.scene_pixel_scale)
         self.height_pixels = int(self.height * self.scene_pixel_scale)
-        self.img = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
+
+        self.position = LinAlg.Vector3(0)
+        self.yaw = 0 # rotation around the vertical axis, radians
+        self.pitch = 0 # positive looks up (towards -y), radians
+        self._update_basis()
+
+        self.reset()
+
+        self._stop = False
+
+    def reset(self): # discard accumulated samples, e.g. after the view changed
+        # full-frame buffers are allocated by the first render(), render_buckets() never needs them
+        self.img = None
+        # first-hit auxiliary buffers, accumulated like img and used to guide denoising
+        self.albedo = None
+        self.normal = None
+        self.depth_buffer = None
 
         self.render_count = 0
         self.render_time = []
 
-        self._stop = False
+    def __getstate__(self): # view and settings only, accumulated samples stay local
+        state = self.__dict__.copy()
+        for name in ("img", "albedo", "normal", "depth_buffer"): state[name] = None
+        state["render_count"] = 0
+        state["render_time"] = []
+        state["_stop"] = False
+        return state
+
+    def _allocate_buffers(self):
+        self.img = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
+        self.albedo = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
+        self.normal = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
+        self.depth_buffer = [[0]*self.width_pixels for _ in range(self.height_pixels)]
+
+    def _update_basis(self):
+        cp, sp = math.cos(self.pitch), math.sin(self.pitch)
+        cy, sy = math.cos(self.yaw), math.sin(self.yaw)
+        self.forward = LinAlg.Vector3(sy * cp, -sp, cy * cp)
+        self.right = LinAlg.Vector3(cy, 0, -sy)
+        self.down = self.forward.cross(self.right) # image rows grow along +y
+
+    def set_position(self, position:LinAlg.Vector3):
+        self.position = position
+
+    def set_orientation(self, yaw:float, pitch:float):
+        self.yaw = yaw
+        self.pitch = max(-math.pi / 2 + 1e-3, min(math.pi / 2 - 1e-3, pitch))
+        self._update_basis()
+
+    def move(self, forward:float=0, right:float=0, down:float=0): # relative to the current view
+        self.position = self.position + self.forward * forward + self.right * right + self.down * down
+
+    def rotate(self, yaw:float=0, pitch:float=0):
+        self.set_orientation(self.yaw + yaw, self.pitch + pitch)
+
+    @property
+    def fov(self) -> float: # horizontal field of view, radians
+        return 2 * math.atan(self.width / 2 / self.depth)
+
+    def set_fov(self, fov:float):
+        fov = max(0.01, min(math.pi - 0.01, fov))
+        self.depth = self.width / 2 / math.tan(fov / 2)
+
+    def pixel_direction(self, x:float, y:float) -> LinAlg.Vector3:
+        return self.right * (x / self.scene_pixel_scale - self.width / 2) \
+            + self.down * (y / self.scene_pixel_scale - self.height / 2) \
+            + self.forward * self.depth
 
     def set_parameters(self, rays_per_pixel:int, max_reflections:int):
         self.rays_per_pixel = rays_per_pixel
         self.max_reflections = max_reflections
 
-    def ray_color(self, r:Ray.Ray, reflections:int) -> LinAlg.Vector3:
+    def ray_color(self, r:Ray.Ray, reflections:int, aux:list=None) -> LinAlg.Vector3:
         if reflections == 0: return self.scene.get_background(r.direction)
 
-        hitinfo_min = RaycastableObject.RayHitInfo.empty()
-        for obj in self.scene.objects:
-            hitinfo = obj.hit(r)
-            if hitinfo.t < hitinfo_min.t:
-                hitinfo_min = hitinfo
+        hitinfo_min = self.scene.hit(r)
 
         if hitinfo_min:
-            if hitinfo_min.hit_object.material.emission_strength > 0:
+            if aux is not None: # [albedo, normal, depth] of the first hit
+                material = hitinfo_min.hit_material
+                aux[0] = material.emission if material.emission_strength > 0 else material.color
+                aux[1] = hitinfo_min.hit_normal
+                aux[2] = hitinfo_min.t
+            if hitinfo_min.hit_material.emission_strength > 0:
                 if reflections == self.max_reflections:
-                    return hitinfo_min.hit_object.material.color
-                return hitinfo_min.hit_object.material.emission
+                    return hitinfo_min.hit_material.color
+                return hitinfo_min.hit_material.emission
             reflection = LinAlg.Vector3.random().norm()
             if reflection.dot(hitinfo_min.hit_normal) < 0:
                 reflection *= -1
             return self.ray_color(
                 Ray.Ray(hitinfo_min.hit_point, reflection),
                 reflections - 1
-            ) * hitinfo_min.hit_object.material.color * 2 * hitinfo_min.hit_normal.dot(reflection)
+            ) * hitinfo_min.hit_material.color * 2 * hitinfo_min.hit_normal.dot(reflection)
         
-        return self.scene.get_background(r.direction)
+        background = self.scene.get_background(r.direction)
+        if aux is not None: aux[0] = background
+        return background
+
+    def sample_pixel(self, x:float, y:float):
+        # rays_per_pixel jittered samples, returns averaged (color, albedo, normal, depth)
+        color, albedo, normal, depth = LinAlg.Vector3(0), LinAlg.Vector3(0), LinAlg.Vector3(0), 0
+        ray = Ray.Ray(self.position, self.pixel_direction(x, y))
+        for _ in range(self.rays_per_pixel):
+            vec_noise = self.right * ((random.random() - 0.5) * 0.0003) \
+                + self.down * ((random.random() - 0.5) * 0.0003)
+            ray.set_direction(ray.direction + vec_noise)
+            aux = [LinAlg.Vector3(0), LinAlg.Vector3(0), 0]
+            color += self.ray_color(ray, self.max_reflections, aux)
+            albedo += aux[0]
+            normal += aux[1]
+            depth += aux[2]
+        n = self.rays_per_pixel
+        return color / n, albedo / n, normal / n, depth / n
 
     def render(self): # can be called multiple times for averaged trayces
+        if self.img is None: self._allocate_buffers()
         self.render_count += 1
-        self._stop = False
         render_time_start = time.time()
 
         total_iterations = self.width_pixels * self.height_pixels
@@ -71,36 +198,87 @@ class Camera:
             for y in range(self.height_pixels):
                 if self._stop: return self.img
                 print(f'percentage complete: {int((x*self.height_pixels + y) / total_iterations * 100)}%', end='\r')
-                ray = Ray.Ray(
-                    LinAlg.Vector3(0),
-                    LinAlg.Vector3(
-                        x / self.scene_pixel_scale - self.width / 2,
-                        y / self.scene_pixel_scale - self.height / 2,
-                        self.depth
-                    )
-                )
-                for _ in range(self.rays_per_pixel):
-                    vec_noise = LinAlg.Vector3(
-                        (random.random() - 0.5) * 0.0003,
-                        (random.random() - 0.5) * 0.0003,
-                        0
-                    )
-                    ray.set_direction(ray.direction + vec_noise)
-                    self.img[y][x] += self.ray_color(ray, self.max_reflections) / self.rays_per_pixel
+                color, albedo, normal, depth = self.sample_pixel(x, y)
+                self.img[y][x] += color
+                self.albedo[y][x] += albedo
+                self.normal[y][x] += normal
+                self.depth_buffer[y][x] += depth
         
         self.render_time.append(time.time() - render_time_start)
         print("\nrender complete")
 
-    def get_img(self, gamma:float=1):
+    def render_buckets(self, filename:str="output.ppm", bucket_size:int=64, passes:int=1, gamma:float=1):
+        # renders bucket by bucket straight into a memory-mapped binary ppm, only one bucket is resident
+        w, h = self.width_pixels, self.height_pixels
+        header = f"P6\n{w} {h}\n255\n".encode()
+        with open(filename, "wb+") as f:
+            f.write(header)
+            f.truncate(len(header) + w * h * 3)
+            f.flush()
+            out = mmap.mmap(f.fileno(), 0)
+            try:
+                render_time_start = time.time()
+                buckets = [(x0, y0) for y0 in range(0, h, bucket_size) for x0 in range(0, w, bucket_size)]
+                for n, (x0, y0) in enumerate(buckets):
+                    print(f'buckets complete: {n}/{len(buckets)}', end='\r')
+                    x1, y1 = min(x0 + bucket_size, w), min(y0 + bucket_size, h)
+                    for y in range(y0, y1):
+                        row = bytearray()
+                        for x in range(x0, x1):
+                            c = LinAlg.Vector3(0)
+                            for _ in range(passes): c += self.sample_pixel(x, y)[0]
+                            c = (c / passes) ** gamma
+                            row += bytes(min(max(int(v * 256), 0), 255) for v in c.to_tuple())
+                        offset = len(header) + (y * w + x0) * 3
+                        out[offset:offset + len(row)] = row
+                    if self._stop: break
+                    out.flush() # finished buckets go to disk, the page cache can drop them
+                self.render_time.append(time.time() - render_time_start)
+                print(f"\nbucket render complete: {filename}")
+            finally:
+                out.close()
+
+    def render_preview(self, step:int): # one sample per step x step block, not accumulated; None if stopped
+        img = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
+        for y0 in range(0, self.height_pixels, step):
+            for x0 in range(0, self.width_pixels, step):
+                if self._stop: return None
+                ray = Ray.Ray(self.position, self.pixel_direction(x0 + step / 2, y0 + step / 2))
+                c = self.ray_color(ray, self.max_reflections)
+                for y in range(y0, min(y0 + step, self.height_pixels)):
+                    row = img[y]
+                    for x in range(x0, min(x0 + step, self.width_pixels)): row[x] = c
+        return img
+
+    def get_img(self, gamma:float=1, denoise:bool=False): # None if stop() interrupts the denoiser
+        if self.img is None: self._allocate_buffers()
         img_result = [[LinAlg.Vector3(0)]*self.width_pixels for _ in range(self.height_pixels)]
         for x in range(self.width_pixels):
             for y in range(self.height_pixels):
-                img_result[y][x] = (self.img[y][x] / self.render_count) ** gamma
+                img_result[y][x] = self.img[y][x] / self.render_count
+        if denoise:
+            albedo, normal, depth = self.get_aux()
+            img_result = Denoise.atrous(img_result, albedo, normal, depth, cancelled=lambda: self._stop)
+            if img_result is None: return None # stopped while filtering
+        for x in range(self.width_pixels):
+            for y in range(self.height_pixels):
+                img_result[y][x] = img_result[y][x] ** gamma
         return img_result
 
-    def stop(self):
+    def get_aux(self): # averaged first-hit albedo, normal and depth buffers
+        if self.img is None: self._allocate_buffers()
+        n = self.render_count
+        albedo = [[v / n for v in row] for row in self.albedo]
+        normal = [[v / n for v in row] for row in self.normal]
+        depth = [[d / n for d in row] for row in self.depth_buffer]
+        return albedo, normal, depth
+
+    def stop(self): # cancels the render in flight and any later ones until resume()
         self._stop = True
 
+    def resume(self): # left to the caller, so a stop() racing with the start of a render is never lost
+        self._stop = False
+
     def save_to_ppm(self, filename:str="output.ppm"):
         with open(filename, 'w') as f:
             f.write(f'P3\n{self.width_pixels} {self.height_pixels}\n255')